@@ -1 +1 @@
-import Analytics.model_interactions
+import Analytics.models
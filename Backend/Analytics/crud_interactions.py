@@ -6,8 +6,9 @@ from collections import Counter
 from sqlalchemy import select
 from sqlalchemy.orm import Session
 
-from db import User
-from Analytics.model_interactions import Item, Interaction
+from Analytics.models import User, UserInfo, ItemInfo, Interaction, PreferenceProfile
+
+PROFILE_FIELDS = ("category", "base_colour", "season", "usage")
 
 def parse_price_to_float(value: Any) -> Optional[float]:
     if value is None:
@@ -19,11 +20,18 @@ def parse_price_to_float(value: Any) -> Optional[float]:
 
 
 def get_user_id(db: Session, username: str) -> Optional[int]:
-    user = db.execute(select(User).where(User.username == username)).scalar_one_or_none()
-    return user.id if user else None
+    return db.execute(select(User.uid).where(User.username == username)).scalar_one_or_none()
+
+
+# interactions and profiles are keyed by str(uid), as in main.py
+def user_key(db: Session, user_id: int) -> str:
+    key = str(user_id)
+    if db.get(UserInfo, key) is None:
+        db.add(UserInfo(username=key, gender=None))
+    return key
 
 
-def identify_item(db: Session, item_payload: Dict[str, Any]) -> Item:
+def identify_item(db: Session, item_payload: Dict[str, Any]) -> ItemInfo:
     item_id = item_payload.get("id")
     if item_id is None:
         raise ValueError("Item id is required in payload")
@@ -32,12 +40,12 @@ def identify_item(db: Session, item_payload: Dict[str, Any]) -> Item:
     if isinstance(item_id, str) and item_id.isdigit():
         item_id = int(item_id)
 
-    existing = db.get(Item, item_id)
+    existing = db.get(ItemInfo, item_id)
     if existing:
         return existing
 
-    new_item = Item(
-        id=item_id,
+    new_item = ItemInfo(
+        item_id=item_id,
         name=item_payload.get("name") or item_payload.get("productDisplayName") or "",
         category=item_payload.get("masterCategory") or "",
         subcategory=item_payload.get("subCategory") or "",
@@ -53,6 +61,57 @@ def identify_item(db: Session, item_payload: Dict[str, Any]) -> Item:
     db.refresh(new_item)
     return new_item
 
+def interaction_weight(liked: bool) -> int:
+    return 3 if liked else 1
+
+
+def add_to_profile(profile: PreferenceProfile, item: ItemInfo, weight: int) -> None:
+    for field in PROFILE_FIELDS:
+        value = getattr(item, field)
+        if value:
+            # assign a new dict so that the JSON column is marked as changed
+            counts = dict(getattr(profile, field) or {})
+            counts[value] = counts.get(value, 0) + weight
+            if counts[value] <= 0:
+                del counts[value] # taken back entirely
+            setattr(profile, field, counts)
+
+
+def new_profile(key: str) -> PreferenceProfile:
+    return PreferenceProfile(username=key, category={}, base_colour={}, season={}, usage={})
+
+
+def rebuild_profile(db: Session, key: str) -> PreferenceProfile:
+    profile = db.get(PreferenceProfile, key)
+    if profile is None:
+        profile = new_profile(key)
+        db.add(profile)
+    else:
+        for field in PROFILE_FIELDS:
+            setattr(profile, field, {})
+
+    query = (
+        db.query(ItemInfo, Interaction.liked)
+        .join(Interaction, ItemInfo.item_id == Interaction.item_id)
+        .filter(Interaction.username == key)
+    )
+    for item, liked in query:
+        add_to_profile(profile, item, interaction_weight(liked))
+    return profile
+
+# for writers of interactions other than record_interaction, such as the
+# /interactions endpoints: applies (item, change in weight) for each item
+# whose interactions changed to the user's profile, locked so that
+# concurrent changes are not lost; without a profile, there is nothing to
+# do, since it is built from the interactions when first needed
+def update_profile(db: Session, key: str, changes: List[Tuple[ItemInfo, int]]) -> None:
+    profile = db.get(PreferenceProfile, key, with_for_update=True, populate_existing=True)
+    if profile is None:
+        return
+    for item, weight in changes:
+        if weight:
+            add_to_profile(profile, item, weight)
+
 # CRUD-style functions
 
 def record_interaction(
@@ -68,21 +127,31 @@ def record_interaction(
     if user_id is None:
         return {"error": "unknown_user", "message": f"username '{username}' not found; create the user first"}
 
+    key = user_key(db, user_id)
     item = identify_item(db, item_payload)
 
     interaction = Interaction(
-        user_id=user_id,
-        item_id=item.id,
+        username=key,
+        item_id=item.item_id,
         viewed=bool(viewed),
         liked=bool(liked),
     )
     db.add(interaction)
+
+    profile = db.get(PreferenceProfile, key)
+    if profile is None:
+        # first interaction since profiles were introduced: fold in history
+        db.flush()
+        rebuild_profile(db, key)
+    else:
+        add_to_profile(profile, item, interaction_weight(liked))
+
     db.commit()
     db.refresh(interaction)
 
     return {
         "interaction_id": interaction.id,
-        "user_id": interaction.user_id,
+        "user_id": user_id,
         "item_id": interaction.item_id,
         "viewed": interaction.viewed,
         "liked": interaction.liked,
@@ -95,33 +164,16 @@ def preference_summary(db: Session, username: str, top_n: int = 10) -> Dict[str,
     if user_id is None:
         return {"username": username, "counts": {}}
 
-    query = (
-        db.query(
-            Item.category,
-            Item.base_colour,
-            Item.season,
-            Item.usage,
-            Interaction.liked,
-        )
-        .join(Interaction, Item.id == Interaction.item_id)
-        .filter(Interaction.user_id == user_id)
-    )
+    key = str(user_id)
+    profile = db.get(PreferenceProfile, key)
+    if profile is None:
+        profile = rebuild_profile(db, user_key(db, user_id))
+        db.commit()
 
-    category_counts: Counter[str] = Counter()
-    colour_counts:   Counter[str] = Counter()
-    season_counts:   Counter[str] = Counter()
-    usage_counts:    Counter[str] = Counter()
-
-    for category, base_colour, season, usage, liked in query:
-        weight = 3 if liked else 1
-        if category:
-            category_counts[category] += weight
-        if base_colour:
-            colour_counts[base_colour] += weight
-        if season:
-            season_counts[season] += weight
-        if usage:
-            usage_counts[usage] += weight
+    category_counts: Counter[str] = Counter(profile.category or {})
+    colour_counts:   Counter[str] = Counter(profile.base_colour or {})
+    season_counts:   Counter[str] = Counter(profile.season or {})
+    usage_counts:    Counter[str] = Counter(profile.usage or {})
 
     def top(counter: Counter[str], n: int) -> List[Tuple[str, int]]:
         return counter.most_common(n)
@@ -144,17 +196,17 @@ def get_recs(db: Session, username: str, limit: int = 10) -> List[Dict[str, Any]
     top_categories = [name for name, _ in (counts.get("category") or [])[:3]]
     top_colours    = [name for name, _ in (counts.get("baseColour") or [])[:3]]
 
-    q = db.query(Item)
+    q = db.query(ItemInfo)
     if top_categories:
-        q = q.filter(Item.category.in_(top_categories))
+        q = q.filter(ItemInfo.category.in_(top_categories))
     if top_colours:
-        q = q.filter(Item.base_colour.in_(top_colours))
+        q = q.filter(ItemInfo.base_colour.in_(top_colours))
     q = q.limit(limit)
 
-    items: List[Item] = q.all()
+    items: List[ItemInfo] = q.all()
     return [
         {
-            "id": it.id,
+            "id": it.item_id,
             "name": it.name,
             "category": it.category,
             "subCategory": it.subcategory,
@@ -1,8 +1,7 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.orm import declarative_base
 
-DATABASE_URL = "sqlite:///./stylr_interactions.db"
+from database import session as SessionLocal
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# sessions are on the database of database.py, and share the connection of
+# the current unit of work; see database.session()
 Base = declarative_base()
@@ -1,8 +1,21 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Float
+from sqlalchemy import Column, Index, Integer, BigInteger, String, Boolean, DateTime, ForeignKey, Float, LargeBinary, JSON
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .db import Base
 
+class User(Base):
+    # the accounts in init.sql, which database.py queries directly
+    __tablename__ = "users"
+    uid = Column(Integer, primary_key=True, autoincrement=True)
+    username = Column(String, nullable=False, unique=True)
+    password = Column(String, nullable=False)
+    salt = Column(String, nullable=False)
+    role = Column(Integer, nullable=False)
+    fullname = Column(String, nullable=False)
+    gender = Column(Integer, nullable=False, default=0)
+    tags = Column(String, nullable=True)
+
+# the rest are keyed by str(uid) as the username
 class UserInfo(Base):
     __tablename__ = "user_information"
     username = Column(String, primary_key=True, unique=True)
@@ -27,6 +40,8 @@ class ItemInfo(Base):
 
 class Interaction(Base):
     __tablename__ = "myaccount_interactions"
+    # for a user's liked items, most recent first (GET /interactions)
+    __table_args__ = (Index("ix_interactions_username_liked_ts", "username", "liked", "ts"),)
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String, ForeignKey("user_information.username"))
     item_id = Column(Integer, ForeignKey("catalog.item_id"))
@@ -35,3 +50,20 @@ class Interaction(Base):
     ts = Column(DateTime, default=datetime.utcnow, index=True)
     user_info = relationship("UserInfo", back_populates="interactions")
     item_info = relationship("ItemInfo", back_populates="interactions")
+
+class SeenItems(Base):
+    # bitset over the positions of the catalog with the given stamp, set for
+    # items the user has interacted with (see match.py)
+    __tablename__ = "seen_items"
+    username = Column(String, ForeignKey("user_information.username"), primary_key=True)
+    stamp = Column(BigInteger, nullable=False)
+    bits = Column(LargeBinary, nullable=False)
+
+class PreferenceProfile(Base):
+    # weighted counts per value, kept up to date by record_interaction
+    __tablename__ = "preference_profiles"
+    username = Column(String, ForeignKey("user_information.username"), primary_key=True)
+    category = Column(JSON, nullable=False, default=dict)
+    base_colour = Column(JSON, nullable=False, default=dict)
+    season = Column(JSON, nullable=False, default=dict)
+    usage = Column(JSON, nullable=False, default=dict)
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+#
+#   Measurements for the backend, meant to be run by hand from this directory
+#   after `init.py` has been run.
+#
+#   imports
+#
+#       Runs `main.py` once per endpoint under `python -X importtime`, in CGI
+#       mode, and reports the wall time, the time spent importing, and the
+#       heaviest top-level imports. With `--budget MS`, exits with an error
+#       if any endpoint spends longer than that importing.
+#
+#   kdf
+#
+#       Hashes a password `--rounds` times with each candidate password
+#       hashing scheme, from `--concurrency` threads at once, and reports
+#       percentiles of the time per hash. With `--budget MS`, marks the
+#       candidates whose p99 is over budget, and exits with an error if the
+#       one configured in main.py is.
+#
+#   tokens
+#
+#       Times issuing and checking access tokens, one at a time and in
+#       batches, in microseconds per token.
+#
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+# method, url, uid to authenticate as (if any), request body (if any)
+endpoints = [
+    ("GET", "/ok", None, None),
+    ("GET", "/uid", 1, None),
+    ("POST", "/login", None, {"username": "yash", "password": "narayan"}),
+    ("GET", "/user", 1, None),
+    ("GET", "/schema", None, None),
+    ("GET", "/match", None, None),
+    ("GET", "/interactions", 1, None),
+]
+
+def importtime(method, url, uid=None, body=None):
+    path, _, query = url.partition("?")
+    env = dict(os.environ, REQUEST_METHOD=method, PATH_INFO=path, QUERY_STRING=query)
+    script = f"import main; main.direct = False; main.bypass_auth = {uid}; main.main()"
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", script],
+        input=b"" if body is None else json.dumps(body).encode(),
+        capture_output=True, env=env)
+    wall = time.perf_counter() - start
+    modules = []
+    for line in proc.stderr.decode().splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules.append((depth, name.strip(), int(cumulative) / 1000))
+    return wall * 1000, modules
+
+# scheme and parameters for main.hash_password
+kdf_candidates = [
+    ("sha512", {}),
+    ("pbkdf2", {"iterations": 100000}),
+    ("pbkdf2", {"iterations": 300000}),
+    ("pbkdf2", {"iterations": 600000}),
+    ("scrypt", {"n": 1 << 13, "r": 8, "p": 1}),
+    ("scrypt", {"n": 1 << 14, "r": 8, "p": 1}),
+    ("scrypt", {"n": 1 << 15, "r": 8, "p": 1}),
+]
+
+def percentile(times, q):
+    times = sorted(times)
+    return times[min(len(times) - 1, int(q * len(times)))]
+
+def report_kdf(opts):
+    from concurrent.futures import ThreadPoolExecutor
+    import main
+    configured = (main.kdf, main.kdf_params[main.kdf])
+    if configured not in kdf_candidates:
+        kdf_candidates.append(configured)
+
+    def timed(scheme, params):
+        start = time.perf_counter()
+        main.hash_password("correct horse", os.urandom(16).hex(), scheme, **params)
+        return (time.perf_counter() - start) * 1000
+
+    over = False
+    print(f"{'scheme':32} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    with ThreadPoolExecutor(opts.concurrency) as executor:
+        for scheme, params in kdf_candidates:
+            times = list(executor.map(lambda _: timed(scheme, params), range(opts.rounds)))
+            p99 = percentile(times, 0.99)
+            name = "$".join([scheme, *map(str, params.values())])
+            flags = []
+            if (scheme, params) == configured:
+                flags.append("configured")
+            if opts.budget is not None and p99 > opts.budget:
+                flags.append("over budget")
+                over = over or (scheme, params) == configured
+            print(f"{name:32} {percentile(times, 0.5):8.1f} {p99:8.1f} {max(times):8.1f}  {', '.join(flags)}")
+    if over:
+        sys.exit(f"configured password hashing over budget of {opts.budget} ms")
+
+def report_tokens(opts):
+    import timeit
+    import main
+    tokens = [main.swt_encode(uid) for uid in range(1000)]
+    cases = [
+        ("encode", lambda: [main.swt_encode(uid) for uid in range(1000)]),
+        ("decode", lambda: [main.swt_decode(token) for token in tokens]),
+        ("decode_many", lambda: main.swt_decode_many(tokens)),
+    ]
+    for name, fn in cases:
+        runs = timeit.repeat(fn, number=1, repeat=opts.rounds)
+        print(f"{name:12} {min(runs) * 1000:8.2f} us/token")
+
+def report_imports(opts):
+    over = False
+    print(f"{'endpoint':24} {'wall ms':>8} {'import ms':>9} {'modules':>7}  heaviest")
+    for method, url, uid, body in endpoints:
+        wall, modules = importtime(method, url, uid, body)
+        top = sorted((m for m in modules if m[0] == 0), key=lambda m: -m[2])
+        total = sum(ms for _, _, ms in top)
+        heaviest = ", ".join(f"{name} {ms:.1f}" for _, name, ms in top[:3])
+        print(f"{method + ' ' + url:24} {wall:8.1f} {total:9.1f} {len(modules):7}  {heaviest}")
+        if opts.budget is not None and total > opts.budget:
+            over = True
+    if over:
+        sys.exit(f"import time over budget of {opts.budget} ms")
+
+commands = {
+    "imports": report_imports,
+    "kdf": report_kdf,
+    "tokens": report_tokens,
+}
+
+def main():
+    import optparse
+    parser = optparse.OptionParser(usage=f"%prog {{{','.join(commands)}}} [options]")
+    parser.add_option("--budget", type="float", help="maximum import time, or p99 hashing time, in milliseconds")
+    parser.add_option("--rounds", type="int", default=50, help="hashes per scheme (kdf), or repetitions (tokens)")
+    parser.add_option("--concurrency", type="int", default=1, help="threads hashing at once (kdf)")
+    opts, args = parser.parse_args()
+    if len(args) != 1 or args[0] not in commands:
+        parser.error("expected one command")
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    commands[args[0]](opts)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#
+#   Least-recently-used cache with expiry, for values that marshal can
+#   serialize.
+#
+#   With a path, entries are also written to an SQLite file, and looked up
+#   there on a miss, so that they outlive the process; this is what makes
+#   caching worthwhile in CGI mode, where every request is a new process.
+#   Deletes go to the file too, but other processes may keep a copy in
+#   memory until it expires, unless the cache is `coherent`, in which case
+#   entries are only kept in the file.
+#
+
+import marshal
+import threading
+import time
+from collections import OrderedDict
+
+class Cache:
+    def __init__(self, size=1024, ttl=300, path=None, *, coherent=False):
+        self.size = size
+        self.ttl = ttl
+        self.path = path
+        self.coherent = coherent and path is not None
+        self.entries = OrderedDict() # key: (expires, value), most recent last
+        self.conn = None
+        self.writes = 0
+        self.lock = threading.Lock()
+
+    def _db(self):
+        if self.conn is None:
+            import sqlite3
+            self.conn = sqlite3.connect(self.path, timeout=1, check_same_thread=False)
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache "
+                "(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL)")
+        return self.conn
+
+    def _remember(self, key, expires, value):
+        if self.coherent:
+            return
+        self.entries[key] = expires, value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def get(self, key, default=None):
+        with self.lock:
+            return self._get(key, default)
+
+    def _get(self, key, default):
+        now = time.time()
+        entry = self.entries.get(key)
+        if entry is not None:
+            expires, value = entry
+            if expires > now:
+                self.entries.move_to_end(key)
+                return value
+            del self.entries[key]
+        if self.path is None:
+            return default
+        row = self._db().execute(
+            "SELECT value, expires FROM cache WHERE key = ? AND expires > ?",
+            (key, now)).fetchone()
+        if row is None:
+            return default
+        data, expires = row
+        value = marshal.loads(data)
+        self._remember(key, expires, value)
+        return value
+
+    def set(self, key, value):
+        with self.lock:
+            self._set(key, value)
+
+    def _set(self, key, value):
+        expires = time.time() + self.ttl
+        self._remember(key, expires, value)
+        if self.path is not None:
+            conn = self._db()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+                    (key, marshal.dumps(value), expires))
+                self.writes += 1
+                if self.writes % self.size == 0:
+                    conn.execute("DELETE FROM cache WHERE expires <= ?", (time.time(),))
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+            if self.path is not None:
+                conn = self._db()
+                with conn:
+                    conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            if self.path is not None:
+                conn = self._db()
+                with conn:
+                    conn.execute("DELETE FROM cache")
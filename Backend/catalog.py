@@ -0,0 +1,418 @@
+#
+#   Memory-mapped catalog index, generated by `init.py`.
+#
+#   data/index:
+#
+#       header      magic, version, number of fields, count
+#       columns     one per field (the gender, then five tag ids), each
+#                   count little-endian uint16, padded to 4 bytes
+#       offsets     (2 * count + 1) little-endian uint32 into data/strings;
+#                   item i spans names [2i, 2i+1) and urls [2i+1, 2i+2)
+#       footer      little-endian uint32 start of each column, then of the
+#                   offsets
+#
+#   data/strings:
+#
+#       names and urls back-to-back, with no separators
+#
+#   data/enums:
+#
+#       marshal snapshot of (gender_names, tag_names, preferences)
+#
+#   data/styles.db:
+#
+#       SQLite table of every row of data/styles.csv, with names normalized
+#       as in data/strings and `item` set to the id that match() returns
+#
+#   data/schema.json:
+#
+#       the preferences from data/enums, encoded as compact JSON for /schema
+#
+#   data/postings:
+#
+#       header      magic, version, number of tags, count
+#       bitsets     one per gender (0 to 2), then one per tag id (0 to
+#                   number of tags - 1), each (count + 7) // 8 bytes;
+#                   bit i of the little-endian integer is set for item i
+#
+
+import marshal
+import mmap
+import struct
+import sys
+from functools import lru_cache
+
+index_file = "data/index"
+strings_file = "data/strings"
+postings_file = "data/postings"
+enums_file = "data/enums"
+styles_file = "data/styles.db"
+schema_file = "data/schema.json"
+
+style_columns = [
+    "id", "gender", "masterCategory", "subCategory", "articleType",
+    "baseColour", "season", "year", "usage", "productDisplayName",
+]
+
+header = struct.Struct("<4sHHI")
+magic = b"STYC"
+version = 2
+fields = 6
+
+postings_header = struct.Struct("<4sHHI")
+postings_magic = b"STYP"
+genders = 3
+
+# maps the binary digits of an integer to one 0/1 byte per item
+_digits = bytes.maketrans(b"01", b"\0\1")
+
+def _uint(typecode, values):
+    from array import array
+    values = array(typecode, values)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+#
+#   The builders write each file under a temporary name next to it, and only
+#   os.replace() it into place once it is complete, so that processes which
+#   still have the old files open or mapped keep reading them undisturbed.
+#
+
+def _partial(path):
+    return path + ".part"
+
+def _discard(*paths):
+    import os
+    for path in paths:
+        try:
+            os.remove(_partial(path))
+        except FileNotFoundError:
+            pass
+
+class Builder:
+    # writes data/index, data/strings and data/postings one item at a time
+    def __init__(self, index_path="index", strings_path="strings", postings_path="postings"):
+        from array import array
+        self.index_path = index_path
+        self.strings_path = strings_path
+        self.strings = open(_partial(strings_path), "wb")
+        self.postings_path = postings_path
+        self.columns = [array("H") for _ in range(fields)]
+        self.offsets = array("I", [0])
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.close()
+        else:
+            self.strings.close()
+            _discard(self.index_path, self.strings_path, self.postings_path)
+
+    def add(self, gender, tags, name, url):
+        self.count += 1
+        for column, value in zip(self.columns, (gender, *tags)):
+            column.append(value)
+        self.strings.write(name)
+        self.offsets.append(self.offsets[-1] + len(name))
+        self.strings.write(url)
+        self.offsets.append(self.offsets[-1] + len(url))
+
+    def close(self):
+        import os
+        if self.strings.closed:
+            return
+        self.strings.close()
+        starts = []
+        with open(_partial(self.index_path), "wb") as file:
+            file.write(header.pack(magic, version, fields, self.count))
+            for values in (*self.columns, self.offsets):
+                file.write(bytes(-file.tell() % 4))
+                starts.append(file.tell())
+                _uint(values.typecode, values).tofile(file)
+            _uint("I", starts).tofile(file)
+
+        size = (self.count + 7) // 8
+        genders_column, *tag_columns = self.columns
+        ntags = 1 + max((max(column, default=0) for column in tag_columns), default=0)
+        bitsets = [bytearray(size) for _ in range(genders + ntags)]
+        for i, gender in enumerate(genders_column):
+            bitsets[gender][i >> 3] |= 1 << (i & 7)
+        for column in tag_columns:
+            for i, tag in enumerate(column):
+                bitsets[genders + tag][i >> 3] |= 1 << (i & 7)
+        with open(_partial(self.postings_path), "wb") as file:
+            file.write(postings_header.pack(postings_magic, version, ntags, self.count))
+            for bitset in bitsets:
+                file.write(bitset)
+
+        # the index last, since its stamp() marks a new catalog
+        for path in (self.strings_path, self.postings_path, self.index_path):
+            os.replace(_partial(path), path)
+
+class StylesBuilder:
+    # writes data/styles.db in batches of rows
+    def __init__(self, styles_path="styles.db"):
+        import sqlite3
+        self.styles_path = styles_path
+        _discard(styles_path)
+        self.conn = sqlite3.connect(_partial(styles_path))
+        self.conn.execute(
+            "CREATE TABLE styles (row INTEGER PRIMARY KEY, item INTEGER, "
+            + ", ".join(f"{column} {'INTEGER' if column == 'id' else 'TEXT'}" for column in style_columns)
+            + ")")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.close()
+        else:
+            self.conn.close()
+            _discard(self.styles_path)
+
+    # rows of (match id or None, styles.csv fields as bytes)
+    def add(self, rows):
+        self.conn.executemany(
+            f"INSERT INTO styles (item, {', '.join(style_columns)}) "
+            f"VALUES (?, {', '.join('?' * len(style_columns))})",
+            ((item, int(style[0]), *(field.decode() for field in style[1:]))
+             for item, style in rows))
+
+    def close(self):
+        self.conn.execute("CREATE INDEX styles_id ON styles (id)")
+        self.conn.execute("CREATE INDEX styles_name ON styles (productDisplayName)")
+        self.conn.commit()
+        self.conn.close()
+        import os
+        os.replace(_partial(self.styles_path), self.styles_path)
+
+def _map(path):
+    with open(path, "rb") as file:
+        return _map_file(file)
+
+def _map_file(file):
+    # mmap refuses empty files
+    if not file.seek(0, 2):
+        return b""
+    return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+# the modification time of an open file, which identifies a build of the
+# catalog when taken from data/index
+def _stamp(file):
+    import os
+    return os.fstat(file.fileno()).st_mtime_ns
+
+def _view(buffer, typecode, start, count):
+    view = memoryview(buffer)[start:start + count * struct.calcsize(typecode)].cast(typecode)
+    if sys.byteorder == "big":
+        from array import array
+        view = array(typecode, view)
+        view.byteswap()
+    return view
+
+class Catalog:
+    stamp = 0 # of the data/index this was loaded from; see stamp()
+
+    # index, strings and postings are buffers in the formats described above
+    def __init__(self, index, strings, postings):
+        self.index = index
+        self.strings = strings
+        tag, ver, size, self.count = header.unpack_from(self.index)
+        if tag != magic or ver != version or size != fields:
+            raise ValueError("unsupported catalog index")
+        *self.starts, start = _view(self.index, "I", len(self.index) - 4 * (fields + 1), fields + 1)
+        self.columns = [_view(self.index, "H", start, self.count) for start in self.starts]
+        self.offsets = _view(self.index, "I", start, 2 * self.count + 1)
+        self.postings = postings
+        tag, ver, self.ntags, count = postings_header.unpack_from(self.postings)
+        if tag != postings_magic or ver != version or count != self.count:
+            raise ValueError("unsupported or stale catalog postings")
+        self.bitset_size = (self.count + 7) // 8
+
+    def __len__(self):
+        return self.count
+
+    # field 0 is the gender, 1 to 5 are the tag ids
+    def column(self, field):
+        return self.columns[field]
+
+    # the same column as a NumPy array, without copying
+    def array(self, field):
+        import numpy as np
+        return np.frombuffer(self.index, dtype="<u2", count=self.count, offset=self.starts[field])
+
+    def _bitset(self, n):
+        start = postings_header.size + n * self.bitset_size
+        return int.from_bytes(self.postings[start:start + self.bitset_size], "little")
+
+    def gender_bits(self, gender):
+        return self._bitset(gender) if 0 <= gender < genders else 0
+
+    def tag_bits(self, tag):
+        return self._bitset(genders + tag) if 0 <= tag < self.ntags else 0
+
+    # expands a bitset into one 0/1 byte per item, e.g. for itertools.compress
+    def flags(self, bits):
+        return f"{bits:0{self.count}b}"[::-1].encode().translate(_digits)
+
+    def record(self, i):
+        gender, *tags = (column[i] for column in self.columns)
+        return gender, tags
+
+    def text(self, i):
+        a, b, c = self.offsets[2 * i:2 * i + 3]
+        return str(self.strings[a:b], "utf-8"), str(self.strings[b:c], "utf-8")
+
+#
+#   Shared memory
+#
+#   A server with several worker processes can publish the catalog once into
+#   a `multiprocessing.shared_memory` segment, and have every worker attach
+#   to it instead of loading the files. Workers then map the same pages and
+#   need no parsing. Set STYLR_CATALOG_SHM to the segment name to make load()
+#   and enums() attach to it.
+#
+#   segment:
+#
+#       header      magic, version, stamp, sizes of the four sections
+#       sections    data/index, data/strings, data/postings, data/enums
+#
+
+shared_header = struct.Struct("<4sHxxQQQQQ")
+shared_magic = b"STYS"
+shared_env = "STYLR_CATALOG_SHM"
+
+def publish(name=None):
+    from multiprocessing import shared_memory
+    sections = []
+    for path in (index_file, strings_file, postings_file, enums_file):
+        with open(path, "rb") as file:
+            if path == index_file:
+                stamp = _stamp(file)
+            sections.append(file.read())
+    size = shared_header.size + sum(map(len, sections))
+    shm = shared_memory.SharedMemory(name, create=True, size=size)
+    shared_header.pack_into(shm.buf, 0, shared_magic, version, stamp, *map(len, sections))
+    start = shared_header.size
+    for section in sections:
+        shm.buf[start:start + len(section)] = section
+        start += len(section)
+    # the caller keeps the segment alive, and must close() and unlink() it
+    return shm
+
+def attach(name):
+    from multiprocessing import shared_memory
+    try:
+        shm = shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        # before Python 3.13, the resource tracker would unlink the segment
+        # as soon as this process exits, even though it did not create it
+        from multiprocessing import resource_tracker
+        shm = shared_memory.SharedMemory(name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+    tag, ver, stamp, *sizes = shared_header.unpack_from(shm.buf)
+    if tag != shared_magic or ver != version:
+        raise ValueError(f"{name}: unsupported shared catalog")
+    sections = []
+    start = shared_header.size
+    for size in sizes:
+        sections.append(shm.buf[start:start + size])
+        start += size
+    index, strings, postings, names = sections
+    catalog = Catalog(index, strings, postings)
+    catalog.stamp = stamp
+    catalog.shm = shm # keeps the mapping alive
+    return catalog, marshal.loads(names)
+
+_catalog = None
+_enums = None
+
+def _attach_shared():
+    global _catalog, _enums
+    import os
+    name = os.environ.get(shared_env)
+    if name and (_catalog is None or _enums is None):
+        _catalog, _enums = attach(name)
+    return bool(name)
+
+def load():
+    global _catalog
+    if _catalog is None and not _attach_shared():
+        with open(index_file, "rb") as file:
+            stamp = _stamp(file)
+            index = _map_file(file)
+        _catalog = Catalog(index, _map(strings_file), _map(postings_file))
+        _catalog.stamp = stamp
+    return _catalog
+
+# identifies the catalog that load() returns, which this process keeps even
+# after init.py rebuilds it; anything derived from positions in it, and kept
+# where other processes can find it, must be keyed by this
+def stamp():
+    return load().stamp
+
+# returns (gender_names, tag_names, preferences)
+def enums():
+    global _enums
+    if _enums is None and not _attach_shared():
+        with open(enums_file, "rb") as file:
+            _enums = marshal.load(file)
+    return _enums
+
+_schema = None
+
+# returns (data/schema.json, an ETag for it)
+def schema():
+    global _schema
+    if _schema is None:
+        import hashlib
+        with open(schema_file, "rb") as file:
+            payload = file.read()
+        _schema = payload, f'"{hashlib.sha1(payload).hexdigest()[:16]}"'
+    return _schema
+
+_styles = None
+
+def _styles_db():
+    global _styles
+    if _styles is None:
+        import sqlite3
+        _styles = sqlite3.connect(f"file:{styles_file}?mode=ro", uri=True, check_same_thread=False)
+    return _styles
+
+def _lookup_style(column, value):
+    row = _styles_db().execute(
+        f"SELECT item, {', '.join(style_columns)} FROM styles "
+        f"WHERE {column} = ? ORDER BY row LIMIT 1",
+        (value,)).fetchone()
+    if row is None:
+        return None
+    item, *values = row
+    return item, dict(zip(style_columns, values))
+
+# returns (match id or None, styles.csv row as a dict); callers must not
+# modify the dict, since it is cached
+@lru_cache(maxsize=1024)
+def lookup_style_name(name):
+    return _lookup_style("productDisplayName", name.strip())
+
+@lru_cache(maxsize=1024)
+def lookup_style_id(id):
+    return _lookup_style("id", id)
+
+# positions in the catalog (match ids - 1) of the styles with the given ids
+# that are in it
+def style_positions(ids):
+    ids = list(ids)
+    positions = set()
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        positions.update(item - 1 for item, in _styles_db().execute(
+            f"SELECT item FROM styles WHERE item IS NOT NULL "
+            f"AND id IN ({', '.join('?' * len(chunk))})", chunk))
+    return positions
@@ -9,9 +9,34 @@ COLOR_KEYWORDS = [
     'Charcoal', 'Steel', 'Skin'
 ]
 
+# (lowercase keyword, color), in order of precedence
+_keywords = [(color.lower(), color) for color in COLOR_KEYWORDS]
+
 def extract_color_from_name(name):
     name_lower = name.lower()
-    for color in COLOR_KEYWORDS:
-        if color.lower() in name_lower:
+    for keyword, color in _keywords:
+        if keyword in name_lower:
             return color
     return ""
+
+# extract_color_from_name() for a whole column of names: each keyword is
+# searched for once over all of the names joined together, instead of once
+# per name
+def extract_colors(names):
+    from bisect import bisect_right
+    names = [name.lower() for name in names]
+    starts = []
+    start = 0
+    for name in names:
+        starts.append(start)
+        start += len(name) + 1
+    text = "\n".join(names)
+    colors = [""] * len(starts)
+    for keyword, color in _keywords:
+        pos = text.find(keyword)
+        while pos >= 0:
+            i = bisect_right(starts, pos) - 1
+            if not colors[i]:
+                colors[i] = color
+            pos = text.find(keyword, pos + 1)
+    return colors
@@ -1,29 +1,295 @@
+import atexit
 import os
+import sys
+import threading
+import time
+from contextvars import ContextVar
 
 database_url = os.getenv("STYLR_DATABASE_URL", "sqlite:data/local.db")
 backend, _, dsn = database_url.partition(":")
 
+# maximum number of open connections, seconds to wait for one to be free,
+# and seconds a connection may sit idle before it is checked on checkout
+pool_size = int(os.getenv("STYLR_DATABASE_POOL_SIZE", "4"))
+pool_timeout = float(os.getenv("STYLR_DATABASE_POOL_TIMEOUT", "30"))
+pool_ping = float(os.getenv("STYLR_DATABASE_POOL_PING", "30"))
+
+# pooled connections are only closed by the pool, with close(), so that
+# SQLAlchemy can be handed one (see session()) and "close" it when done
 if backend == "sqlite":
-    from sqlite3 import IntegrityError, connect
+    import sqlite3
+    from sqlite3 import IntegrityError
+    class Connection(sqlite3.Connection):
+        def close(self):
+            pass
+    def connect(dsn):
+        # pooled connections may be handed to another thread, never shared
+        return sqlite3.connect(dsn, check_same_thread=False, factory=Connection)
+    def close(conn):
+        sqlite3.Connection.close(conn)
     def execute(cur, script, params=None):
         cur.execute(script, params)
+    sqlalchemy_url = "sqlite://"
 elif backend == "psycopg2":
-    from psycopg2 import IntegrityError, connect
+    import psycopg2
+    from psycopg2 import IntegrityError
+    from psycopg2.extensions import connection as _connection
+    class Connection(_connection):
+        def close(self):
+            pass
+    def connect(dsn):
+        return psycopg2.connect(dsn, connection_factory=Connection)
+    def close(conn):
+        _connection.close(conn)
     def execute(cur, script, params=None):
         cur.execute(script.replace("?", "%s"), params)
+    sqlalchemy_url = "postgresql+psycopg2://"
+
+class Pool:
+    def __init__(self, size, timeout, ping):
+        self.size = size
+        self.timeout = timeout
+        self.ping = ping
+        self.idle = [] # (connection, time released), most recent last
+        self.cond = threading.Condition()
+        self.in_use = 0
+        self.created = 0
+        self.discarded = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    def acquire(self):
+        start = time.monotonic()
+        with self.cond:
+            if not self.idle and self.in_use >= self.size:
+                self.waits += 1
+                deadline = start + self.timeout
+                while not self.idle and self.in_use >= self.size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError("timed out waiting for a database connection")
+                    self.cond.wait(remaining)
+            self.in_use += 1
+            conn, released = self.idle.pop() if self.idle else (None, None)
+            waited = time.monotonic() - start
+            self.wait_time += waited
+            self.max_wait = max(self.max_wait, waited)
+        try:
+            if conn is not None and time.monotonic() - released > self.ping:
+                try:
+                    cur = conn.cursor()
+                    execute(cur, "SELECT 1")
+                    cur.fetchall()
+                    conn.rollback()
+                except Exception:
+                    self.discard(conn)
+                    conn = None
+            if conn is None:
+                conn = connect(dsn)
+                with self.cond:
+                    self.created += 1
+        except BaseException:
+            with self.cond:
+                self.in_use -= 1
+                self.cond.notify()
+            raise
+        return conn
+
+    def release(self, conn, *, rollback=False):
+        if rollback:
+            try:
+                conn.rollback()
+            except Exception:
+                self.discard(conn)
+                conn = None
+        with self.cond:
+            self.in_use -= 1
+            if conn is not None:
+                self.idle.append((conn, time.monotonic()))
+            self.cond.notify()
+
+    def discard(self, conn):
+        with self.cond:
+            self.discarded += 1
+        try:
+            close(conn)
+        except Exception:
+            pass
+
+    def clear(self):
+        with self.cond:
+            idle, self.idle = self.idle, []
+        for conn, _ in idle:
+            close(conn)
+
+    def stats(self):
+        with self.cond:
+            return {
+                "size": self.size,
+                "in_use": self.in_use,
+                "idle": len(self.idle),
+                "created": self.created,
+                "discarded": self.discarded,
+                "waits": self.waits,
+                "wait_time": self.wait_time,
+                "max_wait": self.max_wait,
+            }
+
+pool = Pool(pool_size, pool_timeout, pool_ping)
+atexit.register(pool.clear)
+
+#
+#   Unit of work
+#
+#   Inside `with unit_of_work():`, everything that goes through this module,
+#   whether the functions below or SQLAlchemy sessions from session(), uses
+#   one pooled connection and one transaction, which is committed at the end
+#   of the block, or rolled back if it raises. The connection is acquired
+#   the first time something needs it, and nested blocks join the outer one.
+#   Outside of one, each call gets a connection and a transaction of its own.
+#
+
+class UnitOfWork:
+    def __init__(self):
+        self.conn = None
+        self.bind = None # SQLAlchemy connection on conn, for session()
+
+    def connection(self):
+        if self.conn is None:
+            self.conn = pool.acquire()
+        return self.conn
+
+    def close(self, commit=True):
+        conn, self.conn = self.conn, None
+        bind, self.bind = self.bind, None
+        if conn is None:
+            return
+        try:
+            if commit:
+                conn.commit()
+        except BaseException:
+            commit = False
+            raise
+        finally:
+            # once committed, closing it only rolls back nothing
+            if bind is not None:
+                bind.close()
+            pool.release(conn, rollback=not commit)
+
+_work = ContextVar("unit_of_work", default=None)
+
+class unit_of_work:
+    def __enter__(self):
+        self.work = _work.get()
+        self.token = None
+        if self.work is None:
+            self.work = UnitOfWork()
+            self.token = _work.set(self.work)
+        return self.work
+
+    def __exit__(self, exc_type, *exc_info):
+        if self.token is not None:
+            _work.reset(self.token)
+            self.work.close(commit=exc_type is None)
 
 def transaction(fn):
     def wrapper(*args, **kwargs):
-        conn = connect(dsn)
-        cur = conn.cursor()
+        work = _work.get()
+        if work is not None:
+            return fn(work.connection().cursor(), *args, **kwargs)
+        conn = pool.acquire()
         try:
+            cur = conn.cursor()
             res = fn(cur, *args, **kwargs)
             conn.commit()
-        finally:
-            conn.close()
+        except BaseException:
+            pool.release(conn, rollback=True)
+            raise
+        pool.release(conn)
         return res
     return wrapper
 
+_executor = None
+
+# awaits fn(*args, **kwargs) on a thread, one per pooled connection, when
+# called on an event loop; without one (as in CGI), it just calls fn. Either
+# way, fn runs in the caller's unit of work, if any
+async def offload(fn, *args, **kwargs):
+    global _executor
+    asyncio = sys.modules.get("asyncio")
+    try:
+        loop = asyncio.get_running_loop() if asyncio else None
+    except RuntimeError:
+        loop = None
+    if loop is None:
+        return fn(*args, **kwargs)
+    if _executor is None:
+        from concurrent.futures import ThreadPoolExecutor
+        _executor = ThreadPoolExecutor(pool.size, thread_name_prefix="database")
+    from contextvars import copy_context
+    from functools import partial
+    return await loop.run_in_executor(_executor, partial(copy_context().run, fn, *args, **kwargs))
+
+#
+#   SQLAlchemy
+#
+#   The models in Analytics/models.py live in this same database, and their
+#   sessions borrow connections from `pool` rather than having an engine
+#   and pool of their own, so that in a unit of work, a session and the
+#   functions below share its connection and transaction. SQLAlchemy is
+#   only imported by the first session().
+#
+
+_engine = None
+
+def _checkout():
+    work = _work.get()
+    return pool.acquire() if work is None else work.connection()
+
+def engine():
+    global _engine
+    if _engine is None:
+        from contextvars import Context
+        from sqlalchemy import create_engine, event
+        from sqlalchemy.pool import NullPool
+        # resetting on return would roll back the unit of work
+        _engine = create_engine(sqlalchemy_url, creator=_checkout,
+            poolclass=NullPool, pool_reset_on_return=None)
+
+        @event.listens_for(_engine, "connect")
+        def borrow(conn, record):
+            record.info["owned"] = _work.get() is None
+
+        @event.listens_for(_engine, "close")
+        def give_back(conn, record):
+            if record.info.get("owned"):
+                pool.release(conn, rollback=True)
+
+        # the first connection is used to set up the dialect, then rolled
+        # back, so it must not be one with work in progress
+        Context().run(lambda: _engine.connect().close())
+    return _engine
+
+def session():
+    from sqlalchemy.orm import Session
+    work = _work.get()
+    if work is None:
+        return Session(engine(), autoflush=False)
+    if work.bind is None:
+        work.bind = engine().connect()
+        work.bind.begin()
+    # committing is up to the unit of work; rolling back rolls back all of it
+    return Session(work.bind, autoflush=False, join_transaction_mode="rollback_only")
+
+# inserts rows of a model through a session, skipping those whose key is taken
+def insert_ignore(s, model, rows):
+    if s.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    s.execute(insert(model).on_conflict_do_nothing(), rows)
+
 @transaction
 def create_user(cur, username, passhash, salt, role=1):
     try:
@@ -71,3 +337,9 @@ def set_user(cur, uid, **entries):
     execute(cur,
         f"UPDATE users SET {params} WHERE uid = ?",
         (*entries.values(), uid))
+
+@transaction
+def set_password(cur, uid, passhash, salt):
+    execute(cur,
+        "UPDATE users SET password = ?, salt = ? WHERE uid = ?",
+        (passhash, salt, uid))
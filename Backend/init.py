@@ -27,15 +27,29 @@
 #   This script downloads the data required by the application and
 #   performs some minimal data processing.
 #
-#   These files contain raw data:
+#   These files contain raw data, read either as extracted or straight from
+#   the downloaded data/styles.csv.zip and data/images.csv.zip:
 #
 #     - data/styles.csv: list of clothing articles and metadata
 #     - data/images.csv: mapping between filenames and image URLs
 #
 #   These files are generated as output:
 #
-#     - data/items.csv: data in compact form
-#     - enums.py: mappings from criteria numbers to names
+#     - data/index, data/strings: the items in compact, memory-mapped form
+#       (see catalog.py)
+#     - data/postings: per-gender and per-tag bitsets (see catalog.py)
+#     - data/styles.db: data/styles.csv as an SQLite table indexed by id and name
+#     - data/enums: mappings from criteria numbers to names, and the
+#       preference tree, as a marshal snapshot (see catalog.enums)
+#     - data/schema.json: the preference tree, as served by /schema
+#     - data/cache: parsed chunks of the raw data, for faster rebuilds
+#
+#   The recommendations in userSetup.py read another dataset, which has its
+#   own offline snapshot, built with pandas and `datasets` rather than here:
+#
+#     - ProdData/catalog: one .npy file per column and the encoded images,
+#       memory-mapped by userSetup.User; run `python userSetup.py snapshot`
+#       from this directory to build it (see userSetup.setup_snapshot)
 #
 
 import os
@@ -44,6 +58,7 @@ import sys
 source_url = "https://www.kaggle.com/api/v1/datasets/download/paramaggarwal/fashion-product-images-dataset/fashion-dataset%2f"
 source_files = ["styles.csv", "images.csv"]
 database_file = "local.db"
+legacy_interactions_file = "../stylr_interactions.db"
 
 gender_map = {
     b"Unisex": 0,
@@ -66,50 +81,144 @@ def scoreboard(d):
         sorted(d, key=lambda key: (-d[key], key))
     )}
 
-def dump_py_list(file, name, values):
-    file.write(name + b" = [\n")
-    for value in values:
-        file.write(b"\t'" + value + b"',\n")
-    file.write(b"]\n")
-
-def dump_preferences(file, prefs, indent=b"\t"):
-    for key, value in prefs.items():
-        if value:
-            file.write(indent + b"['" + key + b"', [\n")
-            dump_preferences(file, value, indent + b"\t")
-            file.write(indent + b"]],\n")
-        else:
-            file.write(indent + b"'" + key + b"',\n")
+def preference_tree(prefs):
+    return [
+        [key.decode(), preference_tree(value)] if value else key.decode()
+        for key, value in prefs.items()
+    ]
 
 def download_source_file(file):
     from urllib.request import urlopen
-    import io
     import shutil
-    import zipfile
     url = source_url + file
     print(f"Downloading {url}")
-    buffer = io.BytesIO()
-    with urlopen(url) as response:
-        shutil.copyfileobj(response, buffer)
-    print(f"Extracting {file}")
-    zipfile.ZipFile(buffer).extractall()
+    with urlopen(url) as response, open(file + ".zip.part", "wb") as out:
+        shutil.copyfileobj(response, out)
+    os.replace(file + ".zip.part", file + ".zip")
+    # a previously extracted copy would take precedence over the new archive
+    try:
+        os.remove(file)
+    except FileNotFoundError:
+        pass
+
+# either the extracted CSV, or the archive it was downloaded in
+def source_path(file):
+    return file if os.path.exists(file) else file + ".zip"
+
+def open_source(file):
+    path = source_path(file)
+    if path == file:
+        return open(file, "rb")
+    import zipfile
+    with zipfile.ZipFile(path) as archive:
+        # the member keeps its own handle on the archive
+        return archive.open(file)
+
+#
+#   The CSVs are split into chunks of whole lines, and each chunk is parsed
+#   separately, possibly in another process. A chunk ends after any line
+#   whose checksum is a multiple of `chunk_lines`, so that editing a row only
+#   changes the chunk it is in; parsed chunks are kept in data/cache under
+#   their checksum, and only new chunks are parsed again.
+#
 
-def init_data(*, download=False, force=False):
+chunk_lines = 1024
+cache_dir = "cache"
+
+def chunks(file):
+    from zlib import crc32
+    with open_source(file) as source:
+        source.readline() # skip header
+        lines = []
+        for line in source:
+            lines.append(line)
+            if crc32(line) % chunk_lines == 0:
+                yield b"".join(lines)
+                lines.clear()
+        if lines:
+            yield b"".join(lines)
+
+def parse_images(chunk):
+    images = []
+    for line in chunk.splitlines():
+        id, url = line.split(b",")
+        id = assert_removesuffix(id, b".jpg")
+        url = url.strip()
+        if url == b"undefined":
+            continue
+        url = assert_removeprefix(url, b"http://assets.myntassets.com/")
+        if url.startswith(b"v1/"):
+            url = url[3:]
+        images.append((id, url))
+    return images
+
+def parse_styles(chunk):
+    styles = []
+    for line in chunk.splitlines():
+        *fields, name = line.split(b",", 9)
+        styles.append((*fields, name.strip().replace(b",", b";")))
+    return styles
+
+# yields the parsed chunks of `file` in order, keeping at most `window`
+# chunks in flight
+def parse(parser, file, executor, used, window=64):
+    from collections import deque
+    from concurrent.futures import Future
+    import hashlib
+    import marshal
+    pending = deque()
+
+    def finish():
+        key, future, cached = pending.popleft()
+        result = future.result()
+        if not cached:
+            with open(os.path.join(cache_dir, key), "wb") as out:
+                marshal.dump(result, out)
+        return result
+
+    for chunk in chunks(file):
+        key = hashlib.sha1(parser.__name__.encode() + b"\0" + chunk).hexdigest()
+        used.add(key)
+        try:
+            with open(os.path.join(cache_dir, key), "rb") as cached:
+                future = Future()
+                future.set_result(marshal.loads(cached.read()))
+                pending.append((key, future, True))
+        except (FileNotFoundError, EOFError, ValueError):
+            if executor is None:
+                future = Future()
+                future.set_result(parser(chunk))
+            else:
+                future = executor.submit(parser, chunk)
+            pending.append((key, future, False))
+        if len(pending) >= window:
+            yield finish()
+    while pending:
+        yield finish()
+
+def outdated(outputs, sources):
+    try:
+        built = min(os.path.getmtime(file) for file in outputs)
+    except FileNotFoundError:
+        return True
+    return any(os.path.getmtime(source_path(file)) > built for file in sources)
+
+def init_data(*, download=False, force=False, jobs=None):
     for file in source_files:
-        if download or not os.path.exists(file):
+        if download or not os.path.exists(source_path(file)):
             download_source_file(file)
 
-    if not force and os.path.exists("items"):
+    outputs = ("index", "strings", "postings", "enums", "schema.json", "styles.db")
+    if not force and not outdated(outputs, source_files):
         return
 
     from collections import defaultdict
     def recursivedict():
         return defaultdict(recursivedict)
 
-    images = {}
-    items = []
     tagmap = defaultdict(lambda: len(tagmap) + 1)
     preferences = recursivedict()
+    num_items = 0
     num_no_image = 0
     num_skipped = 0
     max_name = 0
@@ -117,52 +226,63 @@ def init_data(*, download=False, force=False):
     max_text = 0
     gender_freq = [0, 0, 0]
 
-    with open("images.csv", "rb") as file:
-        file.readline() # skip header
-        for line in file:
-            id, url = line.split(b",")
-            id = assert_removesuffix(id, b".jpg")
-            url = url.strip()
-            if url == b"undefined":
-                continue
-            url = assert_removeprefix(url, b"http://assets.myntassets.com/")
-            if url.startswith(b"v1/"):
-                url = url[3:]
-            images[id] = url
-
-    with open("styles.csv", "rb") as file:
-        file.readline() # skip header
-        for line in file:
-            id, gender, cat1, cat2, cat3, color, season, year, context, name = line.split(b",", 9)
-            if id not in images:
-                num_no_image += 1
-                continue
-            gender = gender_map[gender]
-            if gender is None:
-                num_skipped += 1
-                continue
-            gender_freq[gender] += 1
-            preferences[b"Categories"][cat1][cat2][cat3] = None
-            if color and color not in (b"Multi", b"NA", b"Unknown"):
-                preferences[b"Colors"][color] = None
-            if context and context not in (b"Multi", b"NA", b"Unknown"):
-                preferences[b"Contexts"][context] = None
-            tags = [
-                tagmap[tag] if tag and tag not in (b"Multi", b"NA", b"Unknown") else 0
-                for tag in [cat1, cat2, cat3, color, context]
-            ]
-            name = name.strip().replace(b",", b";")
-            url = images[id]
-            if len(name) > max_name:
-                max_name = len(name)
-            if len(url) > max_url:
-                max_url = len(url)
-            if len(name) + len(url) > max_text:
-                max_text = len(name) + len(url)
-            items.append((id, gender, tags, name, url))
+    os.makedirs(cache_dir, exist_ok=True)
+    used = set()
+
+    import catalog
+    from concurrent.futures import ProcessPoolExecutor
+    jobs = jobs or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(jobs) if jobs > 1 else None
+    try:
+        images = {}
+        for chunk in parse(parse_images, "images.csv", executor, used):
+            images.update(chunk)
+
+        with catalog.Builder() as index, \
+             catalog.StylesBuilder() as styles:
+            for chunk in parse(parse_styles, "styles.csv", executor, used):
+                rows = []
+                for style in chunk:
+                    id, gender, cat1, cat2, cat3, color, season, year, context, name = style
+                    rows.append((None, style))
+                    if id not in images:
+                        num_no_image += 1
+                        continue
+                    gender = gender_map[gender]
+                    if gender is None:
+                        num_skipped += 1
+                        continue
+                    gender_freq[gender] += 1
+                    preferences[b"Categories"][cat1][cat2][cat3] = None
+                    if color and color not in (b"Multi", b"NA", b"Unknown"):
+                        preferences[b"Colors"][color] = None
+                    if context and context not in (b"Multi", b"NA", b"Unknown"):
+                        preferences[b"Contexts"][context] = None
+                    tags = [
+                        tagmap[tag] if tag and tag not in (b"Multi", b"NA", b"Unknown") else 0
+                        for tag in [cat1, cat2, cat3, color, context]
+                    ]
+                    url = images[id]
+                    if len(name) > max_name:
+                        max_name = len(name)
+                    if len(url) > max_url:
+                        max_url = len(url)
+                    if len(name) + len(url) > max_text:
+                        max_text = len(name) + len(url)
+                    index.add(gender, tags, name, url)
+                    num_items += 1
+                    rows[-1] = (num_items, style)
+                styles.add(rows)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    for key in os.listdir(cache_dir):
+        if key not in used:
+            os.remove(os.path.join(cache_dir, key))
 
     sys.stdout.write(
-        f"items: {len(items)}\n"
+        f"items: {num_items}\n"
         f"  unisex: {gender_freq[0]}\n"
         f"  female: {gender_freq[1]}\n"
         f"  male: {gender_freq[2]}\n"
@@ -174,22 +294,20 @@ def init_data(*, download=False, force=False):
         f"max text: {max_text}\n"
     )
 
-    with open("../enums.py", "wb") as file:
-        file.write(b"# Automatically generated by conv.py\n")
-        dump_py_list(file, b"gender_names", gender_map)
-        dump_py_list(file, b"tag_names", tagmap)
-        file.write(b"preferences = [\n")
-        dump_preferences(file, preferences)
-        file.write(b"]\n")
-
-    with open("items", "wb") as file:
-        for id, gender, tags, name, url in items:
-            file.write(bytes([
-                gender,
-                *tags,
-                len(name),
-                len(url)
-            ]) + name + url)
+    import json
+    import marshal
+    tree = preference_tree(preferences)
+    # replaced whole, as the catalog is, for processes that are reading them
+    with open("enums.part", "wb") as file:
+        marshal.dump((
+            [name.decode() for name in gender_map],
+            ["", *(name.decode() for name in tagmap)],
+            tree,
+        ), file)
+    with open("schema.json.part", "w") as file:
+        json.dump(tree, file, separators=(",", ":"))
+    os.replace("enums.part", "enums")
+    os.replace("schema.json.part", "schema.json")
 
 def init_database(*, reset=False):
     with open("../init.sql") as file:
@@ -208,15 +326,73 @@ def init_database(*, reset=False):
         cur = conn.cursor()
         cur.executescript(init_sql)
         conn.commit()
+        if init_analytics():
+            migrate_interactions(conn)
     finally:
         conn.close()
 
+#
+#   The tables of Analytics/models.py are created from the models, with
+#   SQLAlchemy, which using them needs anyway. Interactions used to be kept
+#   in ../stylr_interactions.db; its rows, keyed by str(uid) as they are now,
+#   are copied over once, and the file is then renamed so that they are not
+#   copied again. Preference profiles and seen items are built from the
+#   interactions when first needed. (The production database is not set up
+#   by this script, and needs the same done by hand.)
+#
+
+def init_analytics():
+    try:
+        from sqlalchemy import create_engine
+    except ImportError:
+        print("SQLAlchemy is not installed; skipping the tables of Analytics/models.py")
+        return False
+    from Analytics.models import Base
+    engine = create_engine("sqlite:///" + database_file)
+    try:
+        Base.metadata.create_all(engine)
+    finally:
+        engine.dispose()
+    return True
+
+legacy_interactions = {
+    "user_information": "username, gender",
+    "catalog": "item_id, name, category, subcategory, article_type, base_colour, season, usage, image_url, price, tags",
+    "myaccount_interactions": "username, item_id, viewed, liked, ts",
+}
+
+def migrate_interactions(conn):
+    if not os.path.exists(legacy_interactions_file):
+        return
+    print(f"Copying interactions from {legacy_interactions_file}")
+    conn.execute("ATTACH DATABASE ? AS legacy", (legacy_interactions_file,))
+    try:
+        tables = {name for name, in conn.execute("SELECT name FROM legacy.sqlite_master WHERE type = 'table'")}
+        # the tables have the same names in both, hence the explicit "main."
+        for table, columns in legacy_interactions.items():
+            if table not in tables:
+                continue
+            if table == "myaccount_interactions":
+                # new ids, in the old order; an item the user has interacted
+                # with since keeps only the newer interaction
+                conn.execute(
+                    f"INSERT INTO main.{table} ({columns}) SELECT {columns} FROM legacy.{table} AS old "
+                    f"WHERE NOT EXISTS (SELECT 1 FROM main.{table} AS new "
+                    f"WHERE new.username = old.username AND new.item_id = old.item_id) ORDER BY id")
+            else:
+                conn.execute(f"INSERT OR IGNORE INTO main.{table} ({columns}) SELECT {columns} FROM legacy.{table}")
+        conn.commit()
+    finally:
+        conn.execute("DETACH DATABASE legacy")
+    os.replace(legacy_interactions_file, legacy_interactions_file + ".migrated")
+
 def main():
     import optparse
     parser = optparse.OptionParser()
     parser.add_option("-d", "--data", action="store_const", dest="target", const=1, help="initialize dataset only")
     parser.add_option("-b", "--database", action="store_const", dest="target", const=2, help="initialize database only")
     parser.add_option("-f", "--force", action="count", default=0, help="delete everything and start over (-ff to force download)")
+    parser.add_option("-j", "--jobs", type="int", help="number of processes to parse the dataset with (default: all CPUs)")
     opts, args = parser.parse_args()
     if args:
         parser.error(f"unexpected argument {args[0]!r}")
@@ -231,7 +407,7 @@ def main():
     os.chdir("data")
 
     if opts.target is None or opts.target == 1:
-        init_data(download=opts.force >= 2, force=opts.force >= 1)
+        init_data(download=opts.force >= 2, force=opts.force >= 1, jobs=opts.jobs)
     if opts.target is None or opts.target == 2:
         init_database(reset=opts.force >= 1)
 
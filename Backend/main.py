@@ -1,7 +1,5 @@
 #!/usr/bin/env python3
 
-import hmac
-import json
 import os
 import sys
 import time
@@ -9,46 +7,133 @@ import time
 secret_key = "gurleen_dhillon"
 direct = True
 bypass_auth = None
+max_body = 1 << 20
+max_batch = 500 # records in one POST /interactions/batch
+pretty = False # indent responses; only for the command line
+static_max_age = 300
 
 http_status_map = {
     200: "OK",
+    304: "Not Modified",
     400: "Bad Request",
     401: "Unauthorized",
+    403: "Forbidden",
     404: "Not Found",
     405: "Method Not Allowed",
+    413: "Content Too Large",
     500: "Internal Server Error",
 }
 
 def swt_encode(uid, expire=86400):
-    expire += time.time_ns() // 1000000000
-    data = f"{uid}.{expire}"
-    digest = hmac.new(secret_key.encode(), data.encode(), "sha256").hexdigest()
-    return f"{data}.{digest}"
+    import tokens
+    return tokens.keyring(secret_key).encode(uid, expire)
 
 def swt_decode(token):
-    data, _, digest = token.rpartition(".")
-    uid, _, expire = data.partition(".")
-    try:
-        uid = int(uid)
-        expire = int(expire)
-    except ValueError:
-        return None
-    return (uid if
-        expire > time.time_ns() // 1000000000 and
-        digest == hmac.new(secret_key.encode(), data.encode(), "sha256").hexdigest()
-        else None)
-
-def hash_password(password, salt):
+    import tokens
+    return tokens.keyring(secret_key).decode(token)
+
+# uids, or None, for each of a batch of tokens
+def swt_decode_many(batch):
+    import tokens
+    return tokens.keyring(secret_key).decode_many(batch)
+
+#
+#   Passwords are stored as "scrypt$n$r$p$hash", "pbkdf2$iterations$hash",
+#   or, for accounts created before those, a bare SHA-512 of the password
+#   and salt. New hashes use `kdf` with the parameters in `kdf_params`, and
+#   any other hash is replaced with one of those on a successful login.
+#   `bench.py kdf` measures the cost of each.
+#
+
+kdf = os.getenv("STYLR_KDF", "scrypt")
+kdf_params = {
+    "scrypt": {"n": 1 << 14, "r": 8, "p": 1},
+    "pbkdf2": {"iterations": 600000},
+    "sha512": {},
+}
+
+# recent successful verifications, by hash of password and stored hash
+verify_cache = {}
+verify_cache_size = 1024
+verify_cache_ttl = 300
+
+def hash_password(password, salt, scheme=None, **params):
+    import hashlib
+    scheme = scheme or kdf
+    params = params or kdf_params[scheme]
+    if scheme == "scrypt":
+        n, r, p = params["n"], params["r"], params["p"]
+        digest = hashlib.scrypt(password.encode(), salt=salt.encode(),
+                                n=n, r=r, p=p, maxmem=256 * r * (n + p), dklen=32)
+        return f"scrypt${n}${r}${p}${digest.hex()}"
+    if scheme == "pbkdf2":
+        iterations = params["iterations"]
+        digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt.encode(), iterations)
+        return f"pbkdf2${iterations}${digest.hex()}"
+    if scheme == "sha512":
+        h = hashlib.sha512()
+        h.update(password.encode() + salt.encode())
+        return h.hexdigest()
+    raise ValueError(f"unknown password hashing scheme {scheme!r}")
+
+def parse_password(passhash):
+    if "$" not in passhash:
+        return "sha512", {}
+    scheme, *params, _ = passhash.split("$")
+    if scheme == "scrypt":
+        n, r, p = map(int, params)
+        return scheme, {"n": n, "r": r, "p": p}
+    if scheme == "pbkdf2":
+        return scheme, {"iterations": int(params[0])}
+    raise ValueError(f"unknown password hashing scheme {scheme!r}")
+
+def needs_rehash(passhash):
+    return parse_password(passhash) != (kdf, kdf_params[kdf])
+
+# passhash is None for unknown users, which are checked against a dummy
+# hash so that they take as long as wrong passwords
+def verify_password(password, salt, passhash):
     import hashlib
-    h = hashlib.sha512()
-    h.update(password.encode() + salt.encode())
-    return h.hexdigest()
+    import hmac
+    if passhash is None:
+        hash_password(password, salt)
+        return False
+    key = hashlib.sha256(f"{passhash}\0{salt}\0{password}".encode()).digest()
+    now = time.monotonic()
+    if verify_cache.get(key, 0) > now:
+        return True
+    scheme, params = parse_password(passhash)
+    if not hmac.compare_digest(hash_password(password, salt, scheme, **params), passhash):
+        return False
+    if len(verify_cache) >= verify_cache_size:
+        for old, expire in list(verify_cache.items()):
+            if expire <= now:
+                del verify_cache[old]
+        while len(verify_cache) >= verify_cache_size:
+            del verify_cache[next(iter(verify_cache))]
+    verify_cache[key] = now + verify_cache_ttl
+    return True
+
+# awaits fn(*args) on the event loop's default executor, if there is one;
+# see database.offload
+async def offload(fn, *args):
+    asyncio = sys.modules.get("asyncio")
+    try:
+        loop = asyncio.get_running_loop() if asyncio else None
+    except RuntimeError:
+        loop = None
+    if loop is None:
+        return fn(*args)
+    return await loop.run_in_executor(None, fn, *args)
 
 class Request:
-    def __init__(self, method, path, params):
+    def __init__(self, method, path, params, body=None, receive=None, headers=None):
         self.method = method
         self.path = path
         self.params = params
+        self.body = body
+        self.receive = receive
+        self.headers = headers or {} # lowercase names
 
     def auth(self):
         if bypass_auth:
@@ -62,24 +147,66 @@ class Request:
         return uid
 
     def json(self):
-        data = sys.stdin.read()
+        import json
+        data = sys.stdin.read() if self.body is None else self.body
         try:
             return json.loads(data)
         except:
             raise Response(400, "Could not parse request body")
 
+    # for async handlers: reads the body from `receive` (an ASGI receive
+    # callable), a chunk at a time, or from stdin without one
+    async def read(self):
+        if self.body is None:
+            if self.receive is None:
+                self.body = sys.stdin.read()
+            else:
+                chunks = []
+                size = 0
+                while True:
+                    message = await self.receive()
+                    chunk = message.get("body", b"")
+                    size += len(chunk)
+                    if size > max_body:
+                        raise Response(413)
+                    chunks.append(chunk)
+                    if not message.get("more_body"):
+                        break
+                self.body = b"".join(chunks)
+        return self.body
+
+    async def read_json(self):
+        await self.read()
+        return self.json()
+
 class Response(Exception):
-    def __init__(self, status, body=None, *, compact=False):
+    def __init__(self, status, body=None, *, headers=None, payload=None):
         self.status = status
         self.phrase = http_status_map[self.status]
         self.body = (
             {"message": self.phrase} if body is None else
             {"message": body} if isinstance(body, str) else body
         )
-        self.compact = compact
+        self.headers = headers or {}
+        self.payload = payload # the body, already encoded
+
+def etag(payload):
+    import zlib
+    return f'"{zlib.crc32(payload):08x}{len(payload):x}"'
+
+# a pre-encoded body that only changes with a deployment, or nothing if the
+# client already has it
+def static(req, payload, tag):
+    headers = {"etag": tag, "cache-control": f"public, max-age={static_max_age}"}
+    for match in req.headers.get("if-none-match", "").split(","):
+        match = match.strip()
+        if match in ("*", tag, "W/" + tag):
+            return Response(304, headers=headers, payload=b"")
+    return Response(200, headers=headers, payload=payload)
 
 endpoints = {}
 
+# handlers may be plain functions or coroutine functions
 def api(path):
     if path not in endpoints:
         endpoints[path] = {}
@@ -87,20 +214,25 @@ def api(path):
         endpoints[path][fn.__name__] = fn
     return decorator
 
+def is_async(fn):
+    return bool(fn.__code__.co_flags & 0x80) # inspect.CO_COROUTINE
+
 #---------------------------------------
 
+ok_payload = b'{"message":"Welcome to Stylr!"}'
+
 @api("/ok")
-def GET(req):
-    return Response(200, "Welcome to Stylr!")
+async def GET(req):
+    return static(req, ok_payload, etag(ok_payload))
 
 @api("/uid")
-def GET(req):
+async def GET(req):
     uid = req.auth()
     return Response(200, {"uid": uid})
 
 @api("/login")
-def POST(req):
-    data = req.json()
+async def POST(req):
+    data = await req.read_json()
     from validation import validate_username, validate_password
 
     username = data.get("username")
@@ -112,15 +244,20 @@ def POST(req):
         return Response(400, "Password is required.")
 
     import database
-    res = database.lookup_user(username)
-    if res is None or hash_password(password, res[2]) != res[1]:
+    res = await database.offload(database.lookup_user, username)
+    uid, passhash, salt = res or (None, None, "")
+    if not await offload(verify_password, password, salt, passhash):
         return Response(401, "Invalid credentials. Please try again.")
-    token = swt_encode(res[0])
+    if needs_rehash(passhash):
+        salt = os.urandom(16).hex()
+        passhash = await offload(hash_password, password, salt)
+        await database.offload(database.set_password, uid, passhash, salt)
+    token = swt_encode(uid)
     return Response(200, {"access_token": token})
 
 @api("/register")
-def POST(req):
-    data = req.json()
+async def POST(req):
+    data = await req.read_json()
     from validation import validate_username, validate_password
 
     username = data.get("username")
@@ -133,27 +270,27 @@ def POST(req):
 
     import database
     salt = os.urandom(16).hex()
-    passhash = hash_password(password, salt)
-    uid = database.create_user(username, passhash, salt)
+    passhash = await offload(hash_password, password, salt)
+    uid = await database.offload(database.create_user, username, passhash, salt)
     if uid is None:
         return Response(400, "This username is already taken.")
     token = swt_encode(uid)
     return Response(200, {"access_token": token})
 
 @api("/user")
-def GET(req):
+async def GET(req):
     uid = req.auth()
     import database
-    user = database.get_user(uid)
+    user = await database.offload(database.get_user, uid)
     if user is None:
         return Response(401, "No such user")
     else:
-        return Response(200, user, compact=True)
+        return Response(200, user)
 
 @api("/user")
-def POST(req):
+async def POST(req):
     uid = req.auth()
-    data = req.json()
+    data = await req.read_json()
     from validation import validate_gender, validate_tags
     entries = {}
 
@@ -171,73 +308,196 @@ def POST(req):
 
     if entries:
         import database
-        database.set_user(uid, **entries)
+        import match
+        await database.offload(database.set_user, uid, **entries)
+        match.forget(uid)
     return Response(200)
 
 @api("/schema")
 def GET(req):
-    import enums
-    return Response(200, enums.preferences, compact=True)
+    import catalog
+    return static(req, *catalog.schema())
+
+@api("/stats")
+async def GET(req):
+    uid = req.auth()
+    import database
+    user = await database.offload(database.get_user, uid)
+    if user is None or user["role"] != 0:
+        return Response(403)
+    return Response(200, {"pool": database.pool.stats()})
 
 @api("/match")
 def GET(req):
     from validation import validate_limit
     limit = validate_limit(req.params.get("limit"), default=5, min_val=1, max_val=50)
 
+    uid = req.auth() if "access_token" in req.params or bypass_auth else None
+    if req.params.get("ranked") == "1":
+        try:
+            import rank
+        except ImportError:
+            pass # NumPy is not installed; fall back to random picks
+        else:
+            if uid is None:
+                return Response(200, rank.rank(gender=0, weights=None, limit=limit))
+            prefs = rank.user_weights(uid)
+            if prefs is None:
+                return Response(401, "No such user")
+            gender, weights = prefs
+            import match
+            return Response(200, rank.rank(gender=gender, weights=weights,
+                exclude=match.seen(uid), limit=limit))
+
     import match
-    return Response(200, match.match(gender=0, tags=[1] * 256, limit=limit))
+    cursor = req.params.get("cursor")
+    state = None
+    if cursor:
+        state = match.decode_cursor(cursor)
+        if state is None:
+            return Response(400, "Invalid cursor")
+    if uid is None and cursor is None:
+        return Response(200, match.match(gender=0, tags=None, limit=limit))
+
+    page = match.match_page(uid, limit, state)
+    if page is None:
+        return Response(401, "No such user")
+    items, state = page
+    if cursor is None:
+        return Response(200, items)
+    return Response(200, {"items": items, "cursor": match.encode_cursor(state)})
 
+# the liked items, most recent first; with `limit` or `after`, a page of
+# them as {"items": [...], "after": cursor for the next page or null}
 @api("/interactions")
 def GET(req):
     uid = req.auth()
-    try:
-        from Analytics.db import SessionLocal
+    from datetime import datetime, timedelta
+    epoch = datetime(1970, 1, 1)
+    paged = "limit" in req.params or "after" in req.params
+    after = None
+    if req.params.get("after"):
+        try:
+            ts, _, id = req.params["after"].partition(".")
+            after = epoch + timedelta(microseconds=int(ts, 16)), int(id, 16)
+        except ValueError:
+            return Response(400, "Invalid cursor")
+    from validation import validate_limit
+    limit = validate_limit(req.params.get("limit"), default=50, min_val=1, max_val=500)
+
+    import database
+    with database.unit_of_work():
         from Analytics.models import ItemInfo, Interaction
-        from database import get_user
-        user = get_user(uid)
+        user = database.get_user(uid)
         if not user:
-            return Response(200, [])
-        username = str(uid)
-        s = SessionLocal()
+            return Response(200, {"items": [], "after": None} if paged else [])
+        s = database.session()
         try:
-            interactions = s.query(Interaction, ItemInfo).join(
+            query = s.query(
+                ItemInfo.item_id, ItemInfo.name, ItemInfo.category, ItemInfo.subcategory,
+                ItemInfo.article_type, ItemInfo.base_colour, ItemInfo.season, ItemInfo.usage,
+                ItemInfo.image_url, ItemInfo.price, Interaction.ts, Interaction.id, ItemInfo.tags,
+            ).join(
                 ItemInfo, Interaction.item_id == ItemInfo.item_id
             ).filter(
-                Interaction.username == username,
+                Interaction.username == str(uid),
                 Interaction.liked == True
             ).order_by(
-                Interaction.ts.desc()
-            ).all()
-            items = []
-            for interaction, item in interactions:
-                tags = []
-                if item.tags:
-                    try:
-                        import json
-                        tags = json.loads(item.tags)
-                    except:
-                        pass
-                items.append({
-                    "id": item.item_id,
-                    "name": item.name,
-                    "category": item.category,
-                    "subcategory": item.subcategory,
-                    "article_type": item.article_type,
-                    "base_colour": item.base_colour,
-                    "season": item.season,
-                    "usage": item.usage,
-                    "url": item.image_url,
-                    "price": item.price,
-                    "liked_at": interaction.ts.isoformat() if interaction.ts else None,
-                    "tags": tags
-                }) 
-            return Response(200, items)
+                Interaction.ts.desc(), Interaction.id.desc()
+            )
+            if after is not None:
+                from sqlalchemy import and_, or_
+                ts, id = after
+                query = query.filter(or_(Interaction.ts < ts, and_(Interaction.ts == ts, Interaction.id < id)))
+            rows = query.limit(limit + 1).all() if paged else query.all()
         finally:
             s.close()
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        return Response(200, [])
+    more = paged and len(rows) > limit
+    if more:
+        del rows[limit:]
+
+    # tags are stored as JSON, and copied into the response as they are,
+    # once checked, since older rows may hold anything
+    import json
+    items = []
+    for id, name, category, subcategory, article_type, base_colour, season, usage, url, price, ts, _, tags in rows:
+        item = dumps({
+            "id": id,
+            "name": name,
+            "category": category,
+            "subcategory": subcategory,
+            "article_type": article_type,
+            "base_colour": base_colour,
+            "season": season,
+            "usage": usage,
+            "url": url,
+            "price": price,
+            "liked_at": ts.isoformat() if ts else None,
+        })
+        try:
+            tags = tags.encode() if tags and json.loads(tags) is not None else b"[]"
+        except ValueError:
+            tags = b"[]"
+        items.append(item[:-1] + b',"tags":' + tags + b"}")
+    payload = b"[" + b",".join(items) + b"]"
+    if not paged:
+        return Response(200, payload=payload)
+    cursor = None
+    if more and rows[-1].ts is not None:
+        cursor = "%x.%x" % ((rows[-1].ts - epoch) // timedelta(microseconds=1), rows[-1].id)
+    return Response(200, payload=b'{"items":' + payload + b',"after":' + dumps(cursor) + b"}")
+
+def interaction_item(item):
+    qid = item.get("id")
+    if isinstance(qid, str) and qid.isdigit():
+        qid = int(qid)
+    original_url = item.get("url", "")
+    original_name = item.get("name", "")
+    original_tags = item.get("tags", [])
+    if not item.get("articleType"):
+        try:
+            import catalog
+            style = catalog.lookup_style_name(original_name)
+            if style is not None:
+                _, row = style
+                qid = row["id"]
+                item = {**row, "url": original_url, "id": qid, "tags": original_tags}
+        except Exception as e:
+            print(f"Could not load item details from catalog: {e}")
+
+    name = item.get("productDisplayName") or item.get("name") or ""
+    category = item.get("masterCategory") or item.get("category") or ""
+    subcategory = item.get("subCategory") or item.get("subcategory") or ""
+    article_type_csv = item.get("articleType") or item.get("article_type") or ""
+    base_colour_csv = item.get("baseColour") or item.get("base_colour") or ""
+    season = item.get("season") or ""
+    usage = item.get("usage") or ""
+    image_url = item.get("url") or item.get("imageURL") or ""
+    price = item.get("price")
+    tags = item.get("tags", [])
+    article_type = category if category else article_type_csv
+
+    from colors import extract_color_from_name
+    base_colour = extract_color_from_name(name) if name else ""
+    if not base_colour:
+        base_colour = base_colour_csv
+    import json
+    tags_json = json.dumps(tags, separators=(",", ":"), ensure_ascii=False) if tags else None
+
+    return {
+        "item_id": qid if isinstance(qid, int) else None,
+        "name": name,
+        "category": category,
+        "subcategory": subcategory,
+        "article_type": article_type,
+        "base_colour": base_colour,
+        "season": season,
+        "usage": usage,
+        "image_url": image_url,
+        "price": price,
+        "tags": tags_json,
+    }
+
 @api("/interactions")
 def POST(req):
     uid = req.auth()
@@ -248,94 +508,128 @@ def POST(req):
     liked = bool(data.get("liked", False))
 
     try:
-        from Analytics.db import SessionLocal
-        from Analytics.models import UserInfo, ItemInfo, Interaction
-        from database import get_user
-        user = get_user(uid)
-        if not user:
-            return Response(400, "User not found")
-        username = str(uid)
+        import database
+        with database.unit_of_work():
+            from Analytics.models import UserInfo, ItemInfo, Interaction
+            user = database.get_user(uid)
+            if not user:
+                return Response(400, "User not found")
+            username = str(uid)
+
+            s = database.session()
+            try:
+                db_user = s.query(UserInfo).filter_by(username=username).first()
+                if not db_user:
+                    db_user = UserInfo(username=username, gender=None)
+                    s.add(db_user)
+                    s.flush()
+                info = interaction_item(item)
+                qid = info["item_id"]
+
+                from Analytics.crud_interactions import interaction_weight, update_profile
+                db_item = None
+                weight = interaction_weight(liked)
+                if qid is not None:
+                    replaced = s.query(Interaction.liked).filter_by(username=username, item_id=qid).all()
+                    weight -= sum(interaction_weight(old) for old, in replaced)
+                    s.query(Interaction).filter_by(username=username, item_id=qid).delete()
+                    db_item = s.query(ItemInfo).filter_by(item_id=qid).first()
+                if not db_item:
+                    db_item = ItemInfo(**info)
+                    s.add(db_item)
+                    s.flush()
+
+                inter = Interaction(username=username, item_id=db_item.item_id, viewed=viewed, liked=liked)
+                s.add(inter)
+                import match
+                match.mark_seen(s, username, [db_item.item_id])
+                update_profile(s, username, [(db_item, weight)])
+                s.commit()
+                return Response(200, {"interaction_id": inter.id, "item_id": db_item.item_id, "saved": True})
+            except Exception as e:
+                s.rollback()
+                import traceback
+                traceback.print_exc()
+                raise
+            finally:
+                s.close()
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return Response(200, {"saved": False, "error": str(e)})
 
-        s = SessionLocal()
-        try:
-            db_user = s.query(UserInfo).filter_by(username=username).first()
-            if not db_user:
-                db_user = UserInfo(username=username, gender=None)
-                s.add(db_user)
-                s.flush()
-            qid = item.get("id") 
-            original_url = item.get("url", "")
-            original_name = item.get("name", "")
-            original_tags = item.get("tags", [])
-            if not item.get("articleType"):
-                try:
-                    import csv
-                    with open("data/styles.csv", "r", encoding="utf-8") as f:
-                        reader = csv.DictReader(f)
-                        for row in reader:
-                            if row.get("productDisplayName", "").strip() == original_name.strip():
-                                qid = int(row.get("id", qid))
-                                item = {**row, "url": original_url, "id": qid, "tags": original_tags}
-                                break
-                except Exception as e:
-                    print(f"Could not load item details from CSV: {e}")
-            
-            s.query(Interaction).filter_by(username=username, item_id=qid).delete()
-            
-            name = item.get("productDisplayName") or item.get("name") or ""
-            category = item.get("masterCategory") or item.get("category") or ""
-            subcategory = item.get("subCategory") or item.get("subcategory") or ""
-            article_type_csv = item.get("articleType") or item.get("article_type") or ""
-            base_colour_csv = item.get("baseColour") or item.get("base_colour") or ""
-            season = item.get("season") or ""
-            usage = item.get("usage") or ""
-            image_url = item.get("url") or item.get("imageURL") or ""
-            price = item.get("price")
-            tags = item.get("tags", [])
-            article_type = category if category else article_type_csv
-
-            from colors import extract_color_from_name
-            base_colour = extract_color_from_name(name) if name else ""
-            if not base_colour:
-                base_colour = base_colour_csv
-            import json
-            tags_json = json.dumps(tags) if tags else None
-
-            db_item = None
-            if isinstance(qid, int):
-                db_item = s.query(ItemInfo).filter_by(item_id=qid).first()
-            if not db_item:
-                db_item = ItemInfo(
-                    item_id=qid if isinstance(qid, int) else None,
-                    name=name,
-                    category=category,
-                    subcategory=subcategory,
-                    article_type=article_type,
-                    base_colour=base_colour,
-                    season=season,
-                    usage=usage,
-                    image_url=image_url,
-                    price=price,
-                    tags=tags_json,
-                )
-                s.add(db_item)
-                s.flush()
-
-            inter = Interaction(username=username, item_id=db_item.item_id, viewed=viewed, liked=liked)
-            s.add(inter)
-            s.commit()
-            return Response(200, {"interaction_id": inter.id, "item_id": db_item.item_id, "saved": True})
-        except Exception as e:
-            s.rollback()
-            import traceback
-            traceback.print_exc()
-            raise
-        finally:
-            s.close()
+@api("/interactions/batch")
+def POST(req):
+    uid = req.auth()
+
+    data = req.json()
+    if not isinstance(data, list):
+        return Response(400, "Expected an array of interactions")
+    if len(data) > max_batch:
+        return Response(400, f"At most {max_batch} interactions per batch")
+
+    # the last record for each item wins, as if they were posted one by one
+    records = {}
+    skipped = 0
+    for record in data:
+        info = interaction_item(record.get("item") or {}) if isinstance(record, dict) else {}
+        qid = info.get("item_id")
+        if qid is None:
+            skipped += 1
+            continue
+        records.pop(qid, None)
+        records[qid] = (info, bool(record.get("viewed", True)), bool(record.get("liked", False)))
+
+    try:
+        import database
+        with database.unit_of_work():
+            from Analytics.models import UserInfo, ItemInfo, Interaction
+            user = database.get_user(uid)
+            if not user:
+                return Response(400, "User not found")
+            username = str(uid)
+
+            s = database.session()
+            try:
+                database.insert_ignore(s, UserInfo, [{"username": username, "gender": None}])
+                if records:
+                    from sqlalchemy import insert
+                    from Analytics.crud_interactions import interaction_weight, update_profile
+                    database.insert_ignore(s, ItemInfo, [info for info, _, _ in records.values()])
+                    weights = {qid: interaction_weight(liked) for qid, (_, _, liked) in records.items()}
+                    for qid, old in s.query(Interaction.item_id, Interaction.liked).filter(
+                        Interaction.username == username,
+                        Interaction.item_id.in_(list(records))
+                    ):
+                        weights[qid] -= interaction_weight(old)
+                    s.query(Interaction).filter(
+                        Interaction.username == username,
+                        Interaction.item_id.in_(list(records))
+                    ).delete(synchronize_session=False)
+                    s.execute(insert(Interaction), [
+                        {"username": username, "item_id": qid, "viewed": viewed, "liked": liked}
+                        for qid, (_, viewed, liked) in records.items()
+                    ])
+                    import match
+                    match.mark_seen(s, username, list(records))
+                    update_profile(s, username, [
+                        (item, weights[item.item_id])
+                        for item in s.query(ItemInfo).filter(ItemInfo.item_id.in_(list(records)))
+                    ])
+                s.commit()
+                return Response(200, {"saved": len(records), "skipped": skipped})
+            except Exception as e:
+                s.rollback()
+                import traceback
+                traceback.print_exc()
+                raise
+            finally:
+                s.close()
     except Exception as e:
         import traceback
         traceback.print_exc()
         return Response(200, {"saved": False, "error": str(e)})
+
 @api("/interactions")
 def DELETE(req):
     uid = req.auth()
@@ -344,31 +638,40 @@ def DELETE(req):
     if not item_id:
         return Response(400, {"error": "item_id required"})
     try:
-        from Analytics.db import SessionLocal
-        from Analytics.models import Interaction
-        from database import get_user
-        user = get_user(uid)
-        if not user:
-            return Response(400, "User not found")
-        username = str(uid)
-        s = SessionLocal()
-        try:
-            deleted_count = s.query(Interaction).filter_by(
-                username=username,
-                item_id=item_id
-            ).delete()
-            s.commit()
-            if deleted_count > 0:
-                return Response(200, {"deleted": True, "count": deleted_count})
-            else:
-                return Response(404, {"error": "Interaction not found"})
-        except Exception as e:
-            s.rollback()
-            import traceback
-            traceback.print_exc()
-            raise
-        finally:
-            s.close()
+        import database
+        with database.unit_of_work():
+            from Analytics.models import ItemInfo, Interaction
+            user = database.get_user(uid)
+            if not user:
+                return Response(400, "User not found")
+            username = str(uid)
+            s = database.session()
+            try:
+                from Analytics.crud_interactions import interaction_weight, update_profile
+                deleted = s.query(Interaction.liked).filter_by(username=username, item_id=item_id).all()
+                deleted_count = s.query(Interaction).filter_by(
+                    username=username,
+                    item_id=item_id
+                ).delete()
+                if deleted_count > 0:
+                    import match
+                    match.mark_seen(s, username, [item_id], seen=False)
+                    db_item = s.get(ItemInfo, item_id)
+                    if db_item is not None:
+                        update_profile(s, username, [
+                            (db_item, -sum(interaction_weight(liked) for liked, in deleted))])
+                s.commit()
+                if deleted_count > 0:
+                    return Response(200, {"deleted": True, "count": deleted_count})
+                else:
+                    return Response(404, {"error": "Interaction not found"})
+            except Exception as e:
+                s.rollback()
+                import traceback
+                traceback.print_exc()
+                raise
+            finally:
+                s.close()
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -376,7 +679,7 @@ def DELETE(req):
 
 #---------------------------------------
 
-def api(method, path, query=None):
+def route(method, path, query, headers=None):
     params = {}
     if query:
         for item in query.split("&"):
@@ -387,18 +690,74 @@ def api(method, path, query=None):
         path = path[4:]
     methods = endpoints.get(path)
     if methods is None:
-        return Response(404)
+        raise Response(404)
     handler = methods.get(method)
     if handler is None:
-        return Response(405)
+        raise Response(405)
+    return handler, Request(method, path, params, headers=headers)
+
+def api(method, path, query=None, body=None, headers=None):
     try:
-        return handler(Request(method, path, params))
+        handler, req = route(method, path, query, headers)
+        req.body = body
+        if not is_async(handler):
+            return handler(req)
+        # without an event loop, async handlers never suspend (see
+        # database.offload), so they finish in one step
+        coro = handler(req)
+        try:
+            coro.send(None)
+        except StopIteration as stop:
+            return stop.value
+        coro.close()
+        raise RuntimeError(f"{method} {path} suspended outside of an event loop")
+    except Response as response:
+        return response
+
+# the same as api(), on an event loop; the body is read from `receive` only
+# if the handler asks for it
+async def dispatch(method, path, query=None, body=None, receive=None, headers=None):
+    try:
+        handler, req = route(method, path, query, headers)
+        req.body = body
+        req.receive = receive
+        if is_async(handler):
+            return await handler(req)
+        # blocking handlers are run on a thread, with the body read up front
+        import asyncio
+        await req.read()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, handler, req)
     except Response as response:
         return response
 
+_dumps = None
+
+# compact JSON as bytes, with orjson if it is installed
+def dumps(obj):
+    global _dumps
+    if _dumps is None:
+        try:
+            import orjson
+            _dumps = lambda obj: orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except ImportError:
+            import json
+            encoder = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False)
+            _dumps = lambda obj: encoder.encode(obj).encode()
+    return _dumps(obj)
+
+def encode(res):
+    if res.payload is not None:
+        return res.payload
+    if pretty:
+        import json
+        return json.dumps(res.body, indent=2).encode()
+    return dumps(res.body)
+
 def main():
-    global bypass_auth
+    global bypass_auth, pretty
 
+    headers = {}
     if direct:
         import optparse
         parser = optparse.OptionParser(usage="%prog METHOD URL [PARAMS...]")
@@ -407,6 +766,7 @@ def main():
         if len(args) < 2:
             parser.error("not enough arguments")
         bypass_auth = opts.uid
+        pretty = True
         method, url = args[:2]
         path, _, query = url.partition("?")
         for arg in args[2:]:
@@ -415,19 +775,24 @@ def main():
         method = os.environ["REQUEST_METHOD"]
         path = os.environ.get("PATH_INFO", "")
         query = os.environ.get("QUERY_STRING", "")
+        for key, value in os.environ.items():
+            if key.startswith("HTTP_"):
+                headers[key[5:].lower().replace("_", "-")] = value
 
     prefix = "HTTP/1.1" if direct else "status:"
-    res = api(method, path, query)
-    body = (json.dumps(res.body, separators=(",", ":")) if res.compact else
-            json.dumps(res.body, indent=2))
+    res = api(method, path, query, headers=headers)
+    body = encode(res)
 
-    sys.stdout.write(f"""\
+    out = sys.stdout.buffer
+    out.write(f"""\
 {prefix} {res.status} {res.phrase}\r
 access-control-allow-origin: *\r
 content-type: application/json\r
-\r
-{body}
-""")
+""".encode())
+    for key, value in res.headers.items():
+        out.write(f"{key}: {value}\r\n".encode())
+    out.write(b"\r\n" + body + (b"\n" if body else b""))
+    out.flush()
 
 if __name__ == "__main__":
     main()
@@ -1,32 +1,278 @@
+def sample(flags, count, limit):
+    import random
+    from itertools import compress, islice
+    if count <= limit:
+        return list(compress(range(len(flags)), flags))
+    if count * 4 >= len(flags):
+        # dense: probe random positions, about len(flags) / count per hit
+        selected = set()
+        while len(selected) < limit:
+            i = random.randrange(len(flags))
+            if flags[i]:
+                selected.add(i)
+        selected = list(selected)
+    else:
+        # sparse: pick ranks, then skip ahead to them without keeping the rest
+        positions = compress(range(len(flags)), flags)
+        selected = []
+        prev = 0
+        for rank in sorted(random.sample(range(count), limit)):
+            selected.append(next(islice(positions, rank - prev, None)))
+            prev = rank + 1
+    random.shuffle(selected)
+    return selected
+
+def candidates(items, gender, tags):
+    # union of the enabled tags' posting lists, intersected with the gender;
+    # tags of None means every item
+    if tags is None:
+        mask = (1 << items.count) - 1
+    else:
+        mask = 0
+        for tag, enabled in enumerate(tags[:items.ntags]):
+            if enabled:
+                mask |= items.tag_bits(tag)
+    if gender:
+        mask &= items.gender_bits(gender)
+    return mask
+
 def match(*, gender, tags, limit=10):
+    import catalog
+    items = catalog.load()
+    flags = items.flags(candidates(items, gender, tags))
+    return describe(items, sample(flags, flags.count(1), limit))
+
+#
+#   Matches for a user's saved preferences are cached in two steps: "user:"
+#   and the uid maps to the user's gender and enabled tag ids, so that the
+#   users table is not read again until POST /user calls forget(); "match:"
+#   and a digest of those and the catalog's stamp() maps to the positions of
+#   the candidates, which are shared by every user with the same preferences.
+#   The digest is taken on every lookup, with the stamp of the catalog this
+#   process has loaded, so that a process on a rebuilt catalog gets new
+#   candidates at once, and one still on the old catalog never stores its
+#   positions where a process on the new one would look.
+#
+#   Set STYLR_MATCH_CACHE to a file name to keep the cache in SQLite too,
+#   which CGI needs to benefit from it at all, and which servers with several
+#   workers need for forget() to reach all of them.
+#
+
+_users = None
+_candidates = None
+
+def caches():
+    global _users, _candidates
+    if _users is None:
+        import os
+        from cache import Cache
+        path = os.getenv("STYLR_MATCH_CACHE")
+        _users = Cache(size=4096, ttl=3600, path=path, coherent=True)
+        _candidates = Cache(size=256, ttl=3600, path=path)
+    return _users, _candidates
+
+# gender and enabled tag ids from a user as returned by database.get_user;
+# no enabled tags means every tag
+def preferences(user):
+    import catalog
+    _, tag_names, _ = catalog.enums()
+    enabled = {name for name, value in (user["tags"] or {}).items() if value}
+    tags = [tag for tag, name in enumerate(tag_names) if tag and name in enabled]
+    return user["gender"] or 0, tags or list(range(1, len(tag_names)))
+
+# (gender, tags, key for their candidates in the current catalog), or None
+# for no such user
+def user_preferences(uid):
+    import catalog
+    import hashlib
+    users, _ = caches()
+    key = f"user:{uid}"
+    prefs = users.get(key)
+    if prefs is None:
+        import database
+        user = database.get_user(uid)
+        if user is None:
+            return None
+        prefs = preferences(user)
+        users.set(key, prefs)
+    gender, tags = prefs
+    digest = hashlib.sha1(repr((catalog.stamp(), gender, tags)).encode()).hexdigest()
+    return gender, tags, digest
+
+def forget(uid):
+    users, _ = caches()
+    users.delete(f"user:{uid}")
+
+# positions of a user's candidates, as uint32, or None for no such user
+def user_candidates(items, uid):
+    prefs = user_preferences(uid)
+    if prefs is None:
+        return None
+    gender, tags, digest = prefs
+    _, cached = caches()
+    key = f"match:{digest}"
+    entry = cached.get(key)
+    if entry is None:
+        from array import array
+        from itertools import compress
+        enabled = bytearray(items.ntags)
+        for tag in tags:
+            if tag < items.ntags:
+                enabled[tag] = 1
+        flags = items.flags(candidates(items, gender, enabled))
+        entry = array("I", compress(range(len(flags)), flags)).tobytes()
+        cached.set(key, entry)
+    return memoryview(entry).cast("I")
+
+#
+#   Items a user has interacted with are left out of their pages. They are
+#   kept as a bitset over catalog positions per user, in the seen_items
+#   table next to the interactions, which the /interactions endpoints keep
+#   up to date through mark_seen(), so that no history is queried to page.
+#   Without a row, or with one for another catalog stamp(), the bitset is
+#   built from the interactions instead, and only mark_seen() stores it, so
+#   that paging never writes. Rows are stamped with the catalog this process
+#   has loaded, whose positions the bits are.
+#
+
+# (row or None, bitset as bytes) for a user
+def _seen_bits(s, items, username):
+    import catalog
+    from Analytics.models import Interaction, SeenItems
+    row = s.get(SeenItems, username)
+    if row is not None and row.stamp == items.stamp and len(row.bits) == items.bitset_size:
+        return row, row.bits
+    ids = [id for id, in s.query(Interaction.item_id).filter(Interaction.username == username)]
+    bits = bytearray(items.bitset_size)
+    for i in catalog.style_positions(ids):
+        bits[i >> 3] |= 1 << (i & 7)
+    return row, bytes(bits)
+
+# the bitset of items a user has interacted with, as bytes
+def seen(uid):
+    import catalog
+    items = catalog.load()
+    try:
+        import database
+        with database.unit_of_work():
+            s = database.session()
+            try:
+                _, bits = _seen_bits(s, items, str(uid))
+            finally:
+                s.close()
+    except Exception:
+        import traceback
+        traceback.print_exc()
+        return bytes(items.bitset_size)
+    return bits
+
+# marks style ids as seen by a user or not, in the session's transaction,
+# once their interactions have been added or deleted; the user must have a
+# user_information row
+def mark_seen(s, username, ids, seen=True):
+    import catalog
+    import database
+    from Analytics.models import SeenItems
+    try:
+        items = catalog.load()
+    except OSError:
+        return # no catalog yet; the bitset is built once there is one
+    s.flush()
+    # the row is locked before it is read, so that concurrent changes for the
+    # same user wait for each other instead of losing bits; an empty row is
+    # added first if there is none, to have something to lock. (On SQLite,
+    # which has no FOR UPDATE, the flush already took the write lock.)
+    database.insert_ignore(s, SeenItems, [{"username": username, "stamp": 0, "bits": b""}])
+    s.get(SeenItems, username, with_for_update=True, populate_existing=True)
+    row, bits = _seen_bits(s, items, username)
+    bits = bytearray(bits)
+    for i in catalog.style_positions(ids):
+        if seen:
+            bits[i >> 3] |= 1 << (i & 7)
+        else:
+            bits[i >> 3] &= ~(1 << (i & 7))
+    row.stamp = items.stamp
+    row.bits = bytes(bits)
+
+#
+#   Pages of matches come in a pseudorandom order given by a seed, so that a
+#   cursor of just the seed and an offset into that order picks up where the
+#   last page left off, without repeats and without keeping the order around.
+#
+
+class Shuffle:
+    # a permutation of range(n), one index at a time: a Feistel network over
+    # the smallest even number of bits that covers n, cycling past indices
+    # of n or more, which takes fewer than four rounds on average
+    def __init__(self, n, seed):
+        import random
+        self.n = n
+        bits = max(2, (n - 1).bit_length())
+        self.half = (bits + 1) // 2
+        self.mask = (1 << self.half) - 1
+        rng = random.Random(seed)
+        self.keys = [rng.getrandbits(32) for _ in range(4)]
+
+    def __getitem__(self, i):
+        while True:
+            left, right = i >> self.half, i & self.mask
+            for key in self.keys:
+                left, right = right, left ^ (((right ^ key) * 0x9E3779B1 >> 7) & self.mask)
+            i = left << self.half | right
+            if i < self.n:
+                return i
+
+def decode_cursor(cursor):
+    seed, _, offset = cursor.partition(".")
+    try:
+        seed, offset = int(seed, 16), int(offset, 16)
+    except ValueError:
+        return None
+    if seed < 0 or offset < 0:
+        return None
+    return seed, offset
+
+def encode_cursor(state):
+    return None if state is None else "%x.%x" % state
+
+# a page of matches for a user (or anyone, if uid is None) from a cursor as
+# returned by decode_cursor(), or None to start over; returns the matches and
+# the cursor for the next page, which is None after the last one, or None
+# for no such user
+def match_page(uid, limit=10, state=None):
+    import catalog
     import random
-    items = []
-    id = 0
-    with open("data/items", "rb") as file:
-        while data := file.read(8):
-            id += 1
-            gen, ta1, ta2, ta3, ta4, ta5, nsz, usz = data
-            name = file.read(nsz).decode()
-            url = file.read(usz).decode()
-            if ((not gender or gender == gen) and (
-                tags[ta1] or
-                tags[ta2] or
-                tags[ta3] or
-                tags[ta4] or
-                tags[ta5])):
-                items.append((id, gen, (ta1, ta2, ta3, ta4, ta5), name, url))
-
-    if not items:
-        return []
-
-    if len(items) > limit:
-        items = random.sample(items, limit)
-
-    import enums
-    return [{
-        "id": id,
-        "gender": enums.gender_names[gender],
-        "tags": [enums.tag_names[tag] for tag in tags if tag],
-        "name": name,
-        "url": "https://assets.myntassets.com/h_720,q_90,w_540/v1/" + url
-    } for id, gender, tags, name, url in items]
+    items = catalog.load()
+    if uid is None:
+        positions = range(len(items))
+        exclude = bytes(items.bitset_size)
+    else:
+        positions = user_candidates(items, uid)
+        if positions is None:
+            return None
+        exclude = seen(uid)
+    seed, offset = (random.getrandbits(32), 0) if state is None else state
+    order = Shuffle(len(positions), seed)
+    selected = []
+    while len(selected) < limit and offset < len(positions):
+        i = positions[order[offset]]
+        offset += 1
+        if not exclude[i >> 3] >> (i & 7) & 1:
+            selected.append(i)
+    return describe(items, selected), (seed, offset) if offset < len(positions) else None
+
+def describe(items, indices):
+    import catalog
+    gender_names, tag_names, _ = catalog.enums()
+    results = []
+    for i in indices:
+        gen, tas = items.record(i)
+        name, url = items.text(i)
+        results.append({
+            "id": i + 1,
+            "gender": gender_names[gen],
+            "tags": [tag_names[tag] for tag in tas if tag],
+            "name": name,
+            "url": "https://assets.myntassets.com/h_720,q_90,w_540/v1/" + url
+        })
+    return results
@@ -0,0 +1,112 @@
+#
+#   Ranked alternative to `match.match()`, using NumPy.
+#
+#   The catalog's gender and tag columns are viewed as uint16 arrays straight
+#   from the memory-mapped index, and a user's preferences are a weight per
+#   tag id. An item's score is the sum of the weights of its five tags, so
+#   scoring the whole catalog is five gathers and their sum.
+#
+
+import numpy as np
+
+import catalog
+import match
+
+class Scorer:
+    def __init__(self, items):
+        self.items = items
+        self.gender = items.array(0)
+        self.tags = [items.array(field) for field in range(1, catalog.fields)]
+        self.rng = np.random.default_rng()
+
+    # weights of None weigh every tag the same; items set in the `exclude`
+    # bitset, as from match.seen(), are left out
+    def score(self, *, gender, weights, exclude=None):
+        if weights is None:
+            table = np.ones(self.items.ntags, dtype=np.float32)
+        else:
+            weights = np.asarray(weights, dtype=np.float32)
+            table = np.zeros(self.items.ntags, dtype=np.float32)
+            table[:min(len(weights), len(table))] = weights[:len(table)]
+        table[0] = 0 # empty tag slot
+        scores = np.zeros(self.items.count, dtype=np.float32)
+        for tags in self.tags:
+            scores += table[tags]
+        if gender:
+            scores[self.gender != gender] = -np.inf
+        if exclude is not None:
+            bits = np.unpackbits(np.frombuffer(exclude, dtype=np.uint8), bitorder="little")
+            scores[bits[:len(scores)].astype(bool)] = -np.inf
+        return scores
+
+    def top(self, scores, limit):
+        # weights are counts, so jitter this small only breaks ties at random
+        scores = scores + self.rng.random(len(scores), dtype=np.float32) * 1e-3
+        limit = min(limit, int(np.isfinite(scores).sum()))
+        if limit <= 0:
+            return []
+        best = np.argpartition(-scores, limit - 1)[:limit]
+        return best[np.argsort(-scores[best])].tolist()
+
+# weight per tag id from tag names, e.g. the counts in a preference profile
+def tag_weights(counts):
+    _, tag_names, _ = catalog.enums()
+    ids = {name: tag for tag, name in enumerate(tag_names) if tag}
+    weights = np.zeros(len(tag_names), dtype=np.float32)
+    for name, weight in counts.items():
+        if name in ids:
+            weights[ids[name]] += weight
+    return weights
+
+# tag name counts in a user's preference profile, or {} without one
+def profile_counts(uid):
+    try:
+        import database
+        from Analytics.crud_interactions import PROFILE_FIELDS
+        from Analytics.models import PreferenceProfile
+        with database.unit_of_work():
+            s = database.session()
+            try:
+                profile = s.get(PreferenceProfile, str(uid))
+                if profile is None:
+                    return {}
+                counts = {}
+                for field in PROFILE_FIELDS:
+                    for name, count in (getattr(profile, field) or {}).items():
+                        counts[name] = counts.get(name, 0) + count
+                return counts
+            finally:
+                s.close()
+    except Exception:
+        import traceback
+        traceback.print_exc()
+        return {}
+
+# (gender, weight per tag id) for a user, or None for no such user: a weight
+# of 1 for each enabled tag, plus the tag's share of their history, scaled
+# so that the most frequent tag counts as much as enabling one
+def user_weights(uid):
+    prefs = match.user_preferences(uid)
+    if prefs is None:
+        return None
+    gender, tags, _ = prefs
+    weights = np.zeros(catalog.load().ntags, dtype=np.float32)
+    weights[[tag for tag in tags if tag < len(weights)]] = 1
+    history = tag_weights(profile_counts(uid))[:len(weights)]
+    if history.max(initial=0) > 0:
+        weights[:len(history)] += history / history.max()
+    return gender, weights
+
+_scorer = None
+
+def load():
+    global _scorer
+    items = catalog.load()
+    if _scorer is None or _scorer.items is not items:
+        _scorer = Scorer(items)
+    return _scorer
+
+def rank(*, gender, weights, exclude=None, limit=10):
+    scorer = load()
+    best = scorer.top(scorer.score(gender=gender, weights=weights, exclude=exclude), limit)
+    return match.describe(scorer.items, best)
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+#
+#   Long-running alternative to running `main.py` as a CGI script.
+#
+#   `app` is an ASGI application, so any ASGI server can host it:
+#
+#       uvicorn server:app
+#
+#   Running this file directly serves it with a small HTTP/1.1 server
+#   built on asyncio, so no third-party packages are needed:
+#
+#       ./server.py --port 8000
+#
+#   Requests go through the same `endpoints` as CGI, but with `dispatch()`,
+#   and imports, caches and database connections are kept between requests.
+#   Async handlers run on the event loop, and offload database calls to
+#   threads (see database.offload); the others are run on a thread pool.
+#   Request bodies are streamed, and only read if the handler needs them.
+#
+#   With `--workers N`, the catalog is published into shared memory once
+#   (see catalog.py) and N processes are forked to accept connections on
+#   the same socket, all attached to that one copy of the catalog.
+#
+
+import asyncio
+
+import main
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    if scope["type"] != "http":
+        return
+
+    headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope["headers"]}
+    try:
+        res = await main.dispatch(scope["method"], scope["path"],
+            scope["query_string"].decode(), receive=receive, headers=headers)
+    except (ConnectionError, asyncio.IncompleteReadError):
+        raise # the client is gone; there is no one to answer
+    except Exception:
+        # as a CGI script that fails, but without losing the connection
+        import traceback
+        traceback.print_exc()
+        res = main.Response(500)
+    payload = main.encode(res)
+
+    await send({
+        "type": "http.response.start",
+        "status": res.status,
+        "headers": [
+            (b"access-control-allow-origin", b"*"),
+            (b"content-type", b"application/json"),
+            # a 304 has no body, and must not claim one of length 0
+            *([] if res.status == 304 else [(b"content-length", str(len(payload)).encode())]),
+            *((key.encode(), value.encode()) for key, value in res.headers.items()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": payload})
+
+async def handle(reader, writer):
+    try:
+        while True:
+            line = await reader.readline()
+            if not line.strip():
+                break
+            method, target, version = line.decode("latin-1").split()
+            headers = []
+            while (line := await reader.readline()).strip():
+                key, _, value = line.decode("latin-1").partition(":")
+                headers.append((key.strip().lower().encode(), value.strip().encode()))
+            fields = dict(headers)
+            remaining = int(fields.get(b"content-length", 0))
+            path, _, query = target.partition("?")
+
+            async def receive():
+                nonlocal remaining
+                chunk = b""
+                if remaining:
+                    chunk = await reader.read(min(remaining, 65536))
+                    if not chunk:
+                        raise ConnectionError("connection closed in request body")
+                    remaining -= len(chunk)
+                return {"type": "http.request", "body": chunk, "more_body": remaining > 0}
+
+            async def send(message):
+                if message["type"] == "http.response.start":
+                    status = message["status"]
+                    writer.write(f"HTTP/1.1 {status} {main.http_status_map[status]}\r\n".encode())
+                    for key, value in message["headers"]:
+                        writer.write(key + b": " + value + b"\r\n")
+                    writer.write(b"\r\n")
+                else:
+                    writer.write(message.get("body", b""))
+
+            await app({
+                "type": "http",
+                "http_version": version.partition("/")[2],
+                "method": method,
+                "path": path,
+                "query_string": query.encode("latin-1"),
+                "headers": headers,
+            }, receive, send)
+            await writer.drain()
+
+            # an unread body is still in the way of the next request
+            if remaining:
+                break
+            connection = fields.get(b"connection", b"").lower()
+            if connection == b"close" or version == "HTTP/1.0" and connection != b"keep-alive":
+                break
+    except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+async def serve(host=None, port=None, *, sock=None):
+    server = await asyncio.start_server(handle, host, port, sock=sock)
+    async with server:
+        if sock is None:
+            print(f"Serving on http://{host}:{port}")
+        await server.serve_forever()
+
+def prefork(host, port, workers):
+    import os
+    import signal
+    import socket
+    import sys
+    import catalog
+    sock = socket.create_server((host, port))
+    shm = None
+    try:
+        shm = catalog.publish()
+        os.environ[catalog.shared_env] = shm.name
+    except FileNotFoundError:
+        print("No catalog to share; run init.py first")
+    # also inherited by the workers, so that they shut down cleanly
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+    children = []
+    try:
+        for _ in range(workers):
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    asyncio.run(serve(sock=sock))
+                except KeyboardInterrupt:
+                    pass
+                finally:
+                    os._exit(0)
+            children.append(pid)
+        print(f"Serving on http://{host}:{port} with {workers} workers")
+        for pid in children:
+            os.waitpid(pid, 0)
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        sock.close()
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+
+def run():
+    import optparse
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_option("-p", "--port", type="int", default=8000, help="port to listen on")
+    parser.add_option("-w", "--workers", type="int", default=1, help="number of worker processes")
+    opts, args = parser.parse_args()
+    if args:
+        parser.error(f"unexpected argument {args[0]!r}")
+    try:
+        if opts.workers > 1:
+            prefork(opts.host, opts.port, opts.workers)
+        else:
+            asyncio.run(serve(opts.host, opts.port))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    run()
@@ -18,7 +18,7 @@ main.secret_key = "for_tests_only"
 database.connect = None
 database.close = lambda conn: None
 
-def api(method, path, params=None, body=None):
+def api(method, path, params=None, body=None, headers=None):
     query = None
     if params is not None:
         query = "&".join(f"{key}={value}" for key, value in params.items())
@@ -26,9 +26,12 @@ def api(method, path, params=None, body=None):
     if body is not None:
         sys.stdin = io.StringIO(json.dumps(body))
     try:
-        return main.api(method, path, query)
+        res = main.api(method, path, query, headers=headers)
     finally:
         sys.stdin = stdin
+    if res.payload:
+        res.body = json.loads(res.payload)
+    return res
 
 class MockConnection(sqlite3.Connection):
     def close(self):
@@ -38,7 +41,7 @@ class MockConnection(sqlite3.Connection):
 def database(monkeypatch):
     import database
     import hashlib
-    conn = sqlite3.connect(":memory:", factory=MockConnection)
+    conn = sqlite3.connect(":memory:", factory=MockConnection, check_same_thread=False)
     try:
         cur = conn.cursor()
         with open(os.path.join(backend_dir, "init.sql")) as file:
@@ -46,10 +49,19 @@ def database(monkeypatch):
         cur.close()
         conn.commit()
         monkeypatch.setattr(database, "connect", lambda url: conn)
+        database.pool.clear()
         yield database
     finally:
+        database.pool.clear()
         sqlite3.Connection.close(conn)
 
+@pytest.fixture
+def analytics(database):
+    pytest.importorskip("sqlalchemy")
+    import db
+    db.init_db()
+    yield database.session
+
 @pytest.fixture
 def auth_admin(monkeypatch):
     monkeypatch.setattr(main, "bypass_auth", 1)
@@ -57,3 +69,47 @@ def auth_admin(monkeypatch):
 @pytest.fixture
 def auth_user(monkeypatch):
     monkeypatch.setattr(main, "bypass_auth", 2)
+
+styles_csv = """\
+id,gender,masterCategory,subCategory,articleType,baseColour,season,year,usage,productDisplayName
+"""
+
+images_csv = """\
+filename,link
+"""
+
+for i, (gender, cat2, cat3, color, usage) in enumerate([
+    ("Men", "Topwear", "Tshirts", "Navy Blue", "Casual"),
+    ("Men", "Bottomwear", "Jeans", "Blue", "Casual"),
+    ("Women", "Topwear", "Tops", "Black", "Formal"),
+    ("Women", "Dress", "Dresses", "Red", "Party"),
+    ("Unisex", "Topwear", "Jackets", "Grey", "Sports"),
+    ("Boys", "Topwear", "Tshirts", "White", "Casual"),
+] * 5, 1000):
+    name = f"Test {color} {cat3} {i}, Sample"
+    styles_csv += f"{i},{gender},Apparel,{cat2},{cat3},{color},Summer,2012,{usage},{name}\n"
+    images_csv += f"{i}.jpg,http://assets.myntassets.com/v1/images/style/{i}.jpg\n"
+
+@pytest.fixture
+def catalog(tmp_path, monkeypatch):
+    import catalog
+    import init
+    data = tmp_path / "data"
+    data.mkdir()
+    (data / "styles.csv").write_text(styles_csv)
+    (data / "images.csv").write_text(images_csv)
+    monkeypatch.chdir(data)
+    init.init_data()
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(catalog, "_catalog", None)
+    monkeypatch.setattr(catalog, "_enums", None)
+    monkeypatch.setattr(catalog, "_styles", None)
+    monkeypatch.setattr(catalog, "_schema", None)
+    import match
+    monkeypatch.setattr(match, "_users", None)
+    monkeypatch.setattr(match, "_candidates", None)
+    catalog.lookup_style_name.cache_clear()
+    catalog.lookup_style_id.cache_clear()
+    yield catalog
+    catalog.lookup_style_name.cache_clear()
+    catalog.lookup_style_id.cache_clear()
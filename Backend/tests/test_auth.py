@@ -92,3 +92,39 @@ def test_register_conflict(database):
         "password": "lee"
     })
     assert res.status == 401
+
+def test_password_schemes():
+    import main
+    for scheme in main.kdf_params:
+        passhash = main.hash_password("narayan", "salt", scheme)
+        assert main.parse_password(passhash)[0] == scheme
+        assert main.verify_password("narayan", "salt", passhash)
+        assert not main.verify_password("narayan!", "salt", passhash)
+    assert not main.verify_password("narayan", "", None)
+
+def test_login_rehashes_legacy(database, monkeypatch):
+    import main
+    monkeypatch.setattr(main, "kdf", "pbkdf2")
+    monkeypatch.setitem(main.kdf_params, "pbkdf2", {"iterations": 1000})
+    _, passhash, _ = database.lookup_user("yash")
+    assert main.parse_password(passhash)[0] == "sha512"
+    for _ in range(2):
+        res = api("POST", "/login", body={"username": "yash", "password": "narayan"})
+        assert res.status == 200
+        _, passhash, salt = database.lookup_user("yash")
+        assert passhash.startswith("pbkdf2$1000$") and salt
+        assert not main.needs_rehash(passhash)
+
+def test_verify_cache(monkeypatch):
+    import main
+    monkeypatch.setattr(main, "verify_cache", {})
+    monkeypatch.setattr(main, "verify_cache_size", 2)
+    hashes = [main.hash_password(password, "salt", "pbkdf2", iterations=1000)
+              for password in ("a", "b", "c")]
+    for password, passhash in zip("abc", hashes):
+        assert main.verify_password(password, "salt", passhash)
+    assert len(main.verify_cache) == 2
+    calls = []
+    monkeypatch.setattr(main, "hash_password", lambda *args, **kwargs: calls.append(args))
+    assert main.verify_password("c", "salt", hashes[2])
+    assert not calls
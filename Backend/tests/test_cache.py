@@ -0,0 +1,32 @@
+from cache import Cache
+
+def test_lru():
+    cache = Cache(size=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+
+def test_expiry():
+    cache = Cache(ttl=-1)
+    cache.set("a", 1)
+    assert cache.get("a", "gone") == "gone"
+
+def test_file(tmp_path):
+    path = str(tmp_path / "cache.db")
+    Cache(path=path).set("a", (1, b"\1"))
+    other = Cache(path=path)
+    assert other.get("a") == (1, b"\1")
+    Cache(path=path).delete("a")
+    assert other.get("a") == (1, b"\1") # still in memory
+    assert Cache(path=path).get("a") is None
+
+def test_coherent(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = Cache(path=path, coherent=True)
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    Cache(path=path).delete("a")
+    assert cache.get("a") is None
@@ -0,0 +1,117 @@
+import os
+
+import pytest
+
+def test_postings_agree_with_columns(catalog):
+    items = catalog.load()
+    for field in range(1, 6):
+        for tag in set(items.column(field)):
+            column = bytes(1 if t == tag else 0 for t in items.column(field))
+            assert all(a <= b for a, b in zip(column, items.flags(items.tag_bits(tag))))
+
+def test_lookup_style_name(catalog):
+    item, row = catalog.lookup_style_name(" Test Red Dresses 1003; Sample ")
+    assert item == 4
+    assert row["id"] == 1003
+    assert row["articleType"] == "Dresses"
+    assert row["baseColour"] == "Red"
+    assert row["usage"] == "Party"
+
+def test_lookup_style_id(catalog):
+    item, row = catalog.lookup_style_id(1005)
+    assert item is None # Boys are not in the catalog
+    assert row["gender"] == "Boys"
+    assert row["productDisplayName"] == "Test White Tshirts 1005; Sample"
+
+def test_lookup_style_missing(catalog):
+    assert catalog.lookup_style_name("Nothing") is None
+    assert catalog.lookup_style_id(1) is None
+
+def test_lookup_matches_catalog(catalog):
+    items = catalog.load()
+    for i in range(len(items)):
+        name, _ = items.text(i)
+        item, _ = catalog.lookup_style_name(name)
+        assert item == i + 1
+
+def test_shared_memory(catalog, monkeypatch):
+    shm = catalog.publish()
+    try:
+        shared, names = catalog.attach(shm.name)
+        items = catalog.load()
+        assert names == catalog.enums()
+        assert len(shared) == len(items)
+        assert shared.ntags == items.ntags
+        assert shared.stamp == items.stamp != 0
+        for i in range(len(items)):
+            assert shared.record(i) == items.record(i)
+            assert shared.text(i) == items.text(i)
+        assert shared.column(3) == items.column(3)
+        assert shared.tag_bits(5) == items.tag_bits(5)
+
+        monkeypatch.setenv(catalog.shared_env, shm.name)
+        monkeypatch.setattr(catalog, "_catalog", None)
+        monkeypatch.setattr(catalog, "_enums", None)
+        assert catalog.load().shm.name == shm.name
+        assert catalog.enums() == names
+    finally:
+        shm.close()
+        shm.unlink()
+
+def test_build_from_zip(catalog, tmp_path, monkeypatch):
+    import zipfile
+    import init
+    from conftest import styles_csv, images_csv
+    outputs = ("index", "strings", "postings", "enums")
+    zipped = tmp_path / "zipped"
+    zipped.mkdir()
+    for name, text in (("styles.csv", styles_csv), ("images.csv", images_csv)):
+        with zipfile.ZipFile(zipped / (name + ".zip"), "w") as archive:
+            archive.writestr(name, text)
+    monkeypatch.chdir(zipped)
+    init.init_data(jobs=2)
+    for name in outputs:
+        assert (zipped / name).read_bytes() == (tmp_path / "data" / name).read_bytes()
+
+    # changing one row only parses its chunk again
+    cached = set(os.listdir("cache"))
+    with zipfile.ZipFile("styles.csv.zip", "w") as archive:
+        archive.writestr("styles.csv", styles_csv.replace("Test Red Dresses 1003", "Test Red Dresses 1003 New"))
+    os.utime("styles.csv.zip", (0, 2 ** 32))
+    init.init_data(jobs=1)
+    assert len(set(os.listdir("cache")) - cached) == 1
+    assert (zipped / "strings").read_bytes() != (tmp_path / "data" / "strings").read_bytes()
+
+def test_wide_fields(catalog, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with catalog.Builder() as builder:
+        for i in range(600):
+            builder.add(i % 3, [i, i + 1, 0, 0, 0], b"n" * i, b"u%d" % i)
+    items = catalog.Catalog(catalog._map("index"), catalog._map("strings"), catalog._map("postings"))
+    assert len(items) == 600 and items.ntags == 601
+    assert items.record(400) == (1, [400, 401, 0, 0, 0])
+    assert items.text(300) == ("n" * 300, "u300")
+    assert list(items.column(2))[298:301] == [299, 300, 301]
+    assert items.flags(items.tag_bits(300))[299:302] == b"\1\1\0"
+    import match
+    assert items.flags(match.candidates(items, 0, None)).count(1) == 600
+    np = pytest.importorskip("numpy")
+    assert np.array_equal(items.array(1), np.arange(600))
+
+def test_rebuild_keeps_old_mapping(catalog, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    def build(n):
+        with catalog.Builder() as builder:
+            for i in range(n):
+                builder.add(0, [1, 0, 0, 0, 0], b"old%d" % i if n == 20 else b"new", b"")
+    build(20)
+    old = catalog.Catalog(catalog._map("index"), catalog._map("strings"), catalog._map("postings"))
+    build(5)
+    assert len(old) == 20 and old.text(19) == ("old19", "")
+    with pytest.raises(RuntimeError):
+        with catalog.Builder() as builder:
+            builder.add(0, [1, 0, 0, 0, 0], b"broken", b"")
+            raise RuntimeError
+    new = catalog.Catalog(catalog._map("index"), catalog._map("strings"), catalog._map("postings"))
+    assert len(new) == 5 and new.text(4) == ("new", "")
+    assert not [name for name in os.listdir() if name.endswith(".part")]
@@ -0,0 +1,19 @@
+import pytest
+from colors import extract_color_from_name, extract_colors
+
+@pytest.mark.parametrize("name, color", [
+    ("Turtle Check Men Navy Blue Shirt", "Navy Blue"),
+    ("NAVY BLUE tee", "Navy Blue"),
+    ("Blue and Black Shirt", "Blue"), # earlier keywords win, wherever they are
+    ("Red Silvered Watch", "Silver"),
+    ("Copperred Top", "Copper"),
+    ("Plain Shirt", ""),
+    ("", ""),
+])
+def test_extract_color(name, color):
+    assert extract_color_from_name(name) == color
+    assert extract_colors([name]) == [color]
+
+def test_extract_colors_column():
+    names = ["İnk Red", "Grey Melange Tee", "Grey", "", "Olive\\nGreen", "Tanned Teal"] * 3
+    assert extract_colors(names) == [extract_color_from_name(name) for name in names]
@@ -0,0 +1,129 @@
+import sqlite3
+import threading
+import pytest
+from conftest import api
+
+def test_pool_reuses_connections(database):
+    created = database.pool.stats()["created"]
+    database.get_user(1)
+    database.get_user(2)
+    database.lookup_user("yash")
+    stats = database.pool.stats()
+    assert stats["created"] == created + 1
+    assert stats["in_use"] == 0
+    assert stats["idle"] == 1
+
+def test_pool_releases_on_error(database):
+    with pytest.raises(sqlite3.Error):
+        database.set_user(1, nonexistent=1)
+    assert database.pool.stats()["in_use"] == 0
+    assert database.get_user(1)["role"] == 0
+
+def test_pool_timeout(monkeypatch):
+    import database
+    pool = database.Pool(1, 0.01, 30)
+    monkeypatch.setattr(database, "connect", lambda dsn: sqlite3.connect(":memory:"))
+    conn = pool.acquire()
+    with pytest.raises(TimeoutError):
+        pool.acquire()
+    pool.release(conn)
+    assert pool.acquire() is conn
+    stats = pool.stats()
+    assert stats["created"] == 1
+    assert stats["waits"] == 1
+
+def test_pool_waits_for_release(monkeypatch):
+    import database
+    pool = database.Pool(1, 5, 30)
+    monkeypatch.setattr(database, "connect", lambda dsn: sqlite3.connect(":memory:", check_same_thread=False))
+    conn = pool.acquire()
+    threading.Timer(0.01, pool.release, (conn,)).start()
+    assert pool.acquire() is conn
+
+def test_pool_ping_discards_broken(monkeypatch):
+    import database
+    pool = database.Pool(1, 5, -1)
+    monkeypatch.setattr(database, "connect", lambda dsn: sqlite3.connect(":memory:"))
+    conn = pool.acquire()
+    pool.release(conn)
+    sqlite3.Connection.close(conn)
+    assert pool.acquire() is not conn
+    assert pool.stats()["discarded"] == 1
+
+def test_stats_admin(auth_admin, database):
+    res = api("GET", "/stats")
+    assert res.status == 200
+    assert res.body["pool"]["created"] >= 1
+
+def test_stats_user(auth_user, database):
+    res = api("GET", "/stats")
+    assert res.status == 403
+
+def test_unit_of_work_one_connection(database):
+    pytest.importorskip("sqlalchemy")
+    from Analytics.models import User
+    database.session().close() # sets up SQLAlchemy
+    created = database.pool.stats()["created"]
+    with database.unit_of_work():
+        database.get_user(1)
+        database.set_user(1, gender=2)
+        s = database.session()
+        assert s.get(User, 1).gender == 2
+        s.close()
+        with database.unit_of_work():
+            assert database.get_user(1)["gender"] == 2
+        assert database.pool.stats()["in_use"] == 1
+    stats = database.pool.stats()
+    assert stats["created"] == created
+    assert stats["in_use"] == 0
+    assert database.get_user(1)["gender"] == 2
+
+def test_unit_of_work_rollback(database):
+    with pytest.raises(ValueError):
+        with database.unit_of_work():
+            database.set_user(1, gender=2)
+            raise ValueError
+    assert database.pool.stats()["in_use"] == 0
+    assert database.get_user(1)["gender"] == 0
+
+def test_session_outside_unit_of_work(database):
+    pytest.importorskip("sqlalchemy")
+    from Analytics.models import User
+    s = database.session()
+    assert s.get(User, 2).username == "daniel"
+    s.close()
+    assert database.pool.stats()["in_use"] == 0
+
+def test_init_database(tmp_path, monkeypatch):
+    pytest.importorskip("sqlalchemy")
+    import os
+    import shutil
+    import init
+    from conftest import backend_dir
+    shutil.copy(os.path.join(backend_dir, "init.sql"), tmp_path)
+    legacy = sqlite3.connect(tmp_path / "stylr_interactions.db")
+    legacy.executescript("""
+        CREATE TABLE user_information (username VARCHAR PRIMARY KEY, gender VARCHAR);
+        CREATE TABLE catalog (item_id INTEGER PRIMARY KEY, name VARCHAR, category VARCHAR,
+            subcategory VARCHAR, article_type VARCHAR, base_colour VARCHAR, season VARCHAR,
+            usage VARCHAR, image_url VARCHAR, price FLOAT, tags VARCHAR);
+        CREATE TABLE myaccount_interactions (id INTEGER PRIMARY KEY, username VARCHAR,
+            item_id INTEGER, viewed BOOLEAN, liked BOOLEAN, ts DATETIME);
+        INSERT INTO user_information VALUES ('2', NULL);
+        INSERT INTO catalog (item_id, name, base_colour) VALUES (7, 'Old', 'Red');
+        INSERT INTO myaccount_interactions VALUES (5, '2', 7, 1, 1, '2024-01-01 00:00:00');
+    """)
+    legacy.commit()
+    legacy.close()
+    (tmp_path / "data").mkdir()
+    monkeypatch.chdir(tmp_path / "data")
+    for _ in range(2):
+        init.init_database()
+    conn = sqlite3.connect("local.db")
+    tables = {name for name, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert {"users", "user_information", "catalog", "myaccount_interactions",
+            "seen_items", "preference_profiles"} <= tables
+    assert conn.execute("SELECT username, item_id, liked FROM myaccount_interactions").fetchall() == [("2", 7, 1)]
+    assert conn.execute("SELECT name FROM catalog").fetchall() == [("Old",)]
+    conn.close()
+    assert sorted(os.listdir(tmp_path)) == ["data", "init.sql", "stylr_interactions.db.migrated"]
@@ -12,9 +12,9 @@ def test_feedback_ack_and_optional_persist():
     if resp.body.get("saved"):
         try:
             from db import Session
-            from Analytics.model_interactions import Interaction
+            from Analytics.models import Interaction
             s = Session()
-            rows = s.query(Interaction).filter_by(user_id=app.swt_decode(token), item_id=123, liked=True).all()
+            rows = s.query(Interaction).filter_by(username=str(app.swt_decode(token)), item_id=123, liked=True).all()
             s.close()
             assert len(rows) == 1
         except Exception:
@@ -0,0 +1,91 @@
+from conftest import api
+
+def liked(analytics):
+    from Analytics.models import Interaction
+    s = analytics()
+    try:
+        return {(i.item_id, i.liked) for i in s.query(Interaction).filter_by(username="2")}
+    finally:
+        s.close()
+
+def test_post(auth_user, database, analytics, catalog):
+    res = api("POST", "/interactions", body={
+        "item": {"id": 4, "name": "Test Red Dresses 1003; Sample", "url": "x"},
+        "viewed": True,
+        "liked": True,
+    })
+    assert res.status == 200
+    assert res.body["saved"] is True
+    assert res.body["item_id"] == 1003
+    assert liked(analytics) == {(1003, True)}
+
+def test_batch(auth_user, database, analytics, catalog):
+    res = api("POST", "/interactions/batch", body=[
+        {"item": {"id": 4, "name": "Test Red Dresses 1003; Sample"}, "liked": True},
+        {"item": {"id": 1, "name": "Test Navy Blue Tshirts 1000; Sample"}, "liked": True},
+        {"item": {"id": 4, "name": "Test Red Dresses 1003; Sample"}, "liked": False},
+        {"item": {"name": "Not in the catalog"}},
+        "nonsense",
+    ])
+    assert res.status == 200
+    assert res.body == {"saved": 2, "skipped": 2}
+    assert liked(analytics) == {(1003, False), (1000, True)}
+
+    res = api("POST", "/interactions/batch", body=[
+        {"item": {"id": 4, "name": "Test Red Dresses 1003; Sample"}, "liked": True},
+    ])
+    assert res.body == {"saved": 1, "skipped": 0}
+    assert liked(analytics) == {(1003, True), (1000, True)}
+
+def test_batch_not_array(auth_user, database, analytics):
+    res = api("POST", "/interactions/batch", body={"item": {"id": 1}})
+    assert res.status == 400
+
+def test_batch_too_large(auth_user, database, analytics):
+    import main
+    res = api("POST", "/interactions/batch", body=[{"item": {"id": 1}}] * (main.max_batch + 1))
+    assert res.status == 400
+    res = api("GET", "/interactions")
+    assert res.body == []
+
+def test_get_pages(auth_user, database, analytics, catalog):
+    names = [
+        "Test Navy Blue Tshirts 1000; Sample",
+        "Test Blue Jeans 1001; Sample",
+        "Test Black Tops 1002; Sample",
+        "Test Red Dresses 1003; Sample",
+        "Test Grey Jackets 1004; Sample",
+    ]
+    api("POST", "/interactions/batch", body=[
+        {"item": {"name": name, "tags": ["a", i]}, "liked": i != 2} for i, name in enumerate(names)
+    ])
+    everything = api("GET", "/interactions").body
+    assert sorted(item["id"] for item in everything) == [1000, 1001, 1003, 1004]
+    assert {item["id"]: item["tags"] for item in everything}[1003] == ["a", 3]
+
+    pages = []
+    res = api("GET", "/interactions", {"limit": 3})
+    while True:
+        assert res.status == 200
+        pages.append(res.body["items"])
+        if res.body["after"] is None:
+            break
+        res = api("GET", "/interactions", {"limit": 3, "after": res.body["after"]})
+    assert [len(page) for page in pages] == [3, 1]
+    assert [item for page in pages for item in page] == everything
+
+def test_get_bad_cursor(auth_user, database, analytics):
+    assert api("GET", "/interactions", {"after": "nonsense"}).status == 400
+
+def test_get_bad_tags(auth_user, database, analytics, catalog):
+    from Analytics.models import ItemInfo
+    api("POST", "/interactions/batch", body=[
+        {"item": {"name": "Test Navy Blue Tshirts 1000; Sample", "tags": ["a"]}, "liked": True},
+        {"item": {"name": "Test Blue Jeans 1001; Sample", "tags": ["b"]}, "liked": True},
+    ])
+    s = analytics()
+    s.query(ItemInfo).filter_by(item_id=1001).update({"tags": "a;b"})
+    s.commit()
+    s.close()
+    res = api("GET", "/interactions")
+    assert {item["id"]: item["tags"] for item in res.body} == {1000: ["a"], 1001: []}
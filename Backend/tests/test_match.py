@@ -1,4 +1,5 @@
 from conftest import api
+import main
 import pytest
 
 def validate_item(item):
@@ -9,14 +10,14 @@ def validate_item(item):
     assert type(item["name"]) is str
     assert type(item["url"]) is str
 
-def test_match(database):
+def test_match(database, catalog):
     res = api("GET", "/match")
     assert res.status == 200
     assert type(res.body) is list
     for item in res.body:
         validate_item(item)
 
-def test_match_limit(database):
+def test_match_limit(database, catalog):
     # use a strange number that can't be the default
     res = api("GET", "/match", {"limit": 9})
     assert res.status == 200
@@ -24,3 +25,211 @@ def test_match_limit(database):
     assert len(res.body) == 9
     for item in res.body:
         validate_item(item)
+
+def test_match_gender(catalog):
+    import match
+    items = match.match(gender=1, tags=[1] * 256, limit=50)
+    assert len(items) == 10
+    assert all(item["gender"] == "Women" for item in items)
+
+def test_match_tags(catalog):
+    import match
+    _, tag_names, _ = catalog.enums()
+    tags = [0] * 256
+    tags[tag_names.index("Jeans")] = 1
+    items = match.match(gender=0, tags=tags, limit=50)
+    assert len(items) == 5
+    assert all("Jeans" in item["tags"] for item in items)
+    assert all(item["name"].startswith("Test Blue Jeans") for item in items)
+    assert all(item["url"].endswith(".jpg") for item in items)
+
+def test_match_none(catalog):
+    import match
+    assert match.match(gender=0, tags=[0] * 256) == []
+
+def test_match_tags_and_gender(catalog):
+    import match
+    _, tag_names, _ = catalog.enums()
+    tags = [0] * 256
+    tags[tag_names.index("Topwear")] = 1
+    items = match.match(gender=2, tags=tags, limit=50)
+    assert len(items) == 5
+    assert all(item["gender"] == "Men" and "Tshirts" in item["tags"] for item in items)
+
+@pytest.mark.parametrize("flags", [
+    bytes([1, 0] * 50),         # dense
+    bytes([1] + [0] * 9) * 10,  # sparse
+])
+def test_sample(flags):
+    from match import sample
+    for limit in (1, 5, 10, 20):
+        selected = sample(flags, flags.count(1), limit)
+        assert len(selected) == min(limit, flags.count(1))
+        assert len(set(selected)) == len(selected)
+        assert all(flags[i] for i in selected)
+
+def test_schema(catalog):
+    res = api("GET", "/schema")
+    assert res.status == 200
+    categories = dict(entry for entry in res.body if type(entry) is list)["Categories"]
+    assert ["Apparel", [["Topwear", ["Tshirts", "Tops", "Jackets"]],
+                        ["Bottomwear", ["Jeans"]],
+                        ["Dress", ["Dresses"]]]] in categories
+
+def test_schema_not_modified(catalog):
+    res = api("GET", "/schema")
+    tag = res.headers["etag"]
+    assert "max-age" in res.headers["cache-control"]
+    res = api("GET", "/schema", headers={"if-none-match": f'"other", {tag}'})
+    assert res.status == 304
+    assert main.encode(res) == b""
+    res = api("GET", "/schema", headers={"if-none-match": '"other"'})
+    assert res.status == 200
+
+def test_match_user(auth_user, database, catalog):
+    res = api("POST", "/user", body={"gender": 1, "tags": {"Tops": 1, "Jeans": 0}})
+    assert res.status == 200
+    res = api("GET", "/match", {"limit": 50})
+    assert res.status == 200
+    assert len(res.body) == 5
+    assert all(item["gender"] == "Women" and "Tops" in item["tags"] for item in res.body)
+
+    # saving preferences invalidates the cached ones
+    api("POST", "/user", body={"gender": 0, "tags": {"Jeans": 1}})
+    res = api("GET", "/match", {"limit": 50})
+    assert len(res.body) == 5
+    assert all("Jeans" in item["tags"] for item in res.body)
+
+def test_match_user_cached(auth_user, database, catalog, tmp_path, monkeypatch):
+    import match
+    monkeypatch.setenv("STYLR_MATCH_CACHE", str(tmp_path / "cache.db"))
+    api("POST", "/user", body={"gender": 2, "tags": {}})
+    first = api("GET", "/match", {"limit": 50}).body
+    assert len(first) == 10
+    assert all(item["gender"] == "Men" for item in first)
+
+    # as if in another process: neither the users table nor the postings
+    # are read again
+    monkeypatch.setattr(match, "_users", None)
+    monkeypatch.setattr(match, "_candidates", None)
+    monkeypatch.setattr(database, "get_user", None)
+    monkeypatch.setattr(match, "candidates", None)
+    second = api("GET", "/match", {"limit": 50}).body
+    assert sorted(item["id"] for item in first) == sorted(item["id"] for item in second)
+
+def test_match_user_rebuilt(auth_user, database, catalog, tmp_path, monkeypatch):
+    import init
+    import match
+    import os
+    monkeypatch.setenv("STYLR_MATCH_CACHE", str(tmp_path / "cache.db"))
+    api("POST", "/user", body={"gender": 2, "tags": {}})
+    assert len(api("GET", "/match", {"limit": 50}).body) == 10
+
+    # a smaller catalog, loaded by a new process with the same cache file
+    data = tmp_path / "data"
+    stamp = catalog.stamp()
+    lines = (data / "styles.csv").read_text().splitlines(True)
+    (data / "styles.csv").write_text("".join(lines[:7]))
+    monkeypatch.chdir(data)
+    init.init_data(force=True)
+    os.utime("index", ns=(0, stamp + 1))
+    monkeypatch.chdir(tmp_path)
+    # a process that is still on the old catalog
+    monkeypatch.setattr(match, "_users", None)
+    monkeypatch.setattr(match, "_candidates", None)
+    assert catalog.stamp() == stamp
+    assert len(api("GET", "/match", {"limit": 50}).body) == 10
+    monkeypatch.setattr(catalog, "_catalog", None)
+    monkeypatch.setattr(catalog, "_styles", None)
+    monkeypatch.setattr(match, "_users", None)
+    monkeypatch.setattr(match, "_candidates", None)
+    res = api("GET", "/match", {"limit": 50})
+    assert res.status == 200
+    assert sorted(item["id"] for item in res.body) == [1, 2]
+
+def test_shuffle():
+    import match
+    for n in (0, 1, 2, 5, 64, 1000):
+        assert sorted(match.Shuffle(n, 7)[i] for i in range(n)) == list(range(n))
+    assert [match.Shuffle(1000, 7)[i] for i in range(10)] == [match.Shuffle(1000, 7)[i] for i in range(10)]
+    assert [match.Shuffle(1000, 7)[i] for i in range(10)] != [match.Shuffle(1000, 8)[i] for i in range(10)]
+
+def test_match_pages(catalog):
+    res = api("GET", "/match", {"limit": 7, "cursor": ""})
+    assert res.status == 200
+    seen = [item["id"] for item in res.body["items"]]
+    cursor = res.body["cursor"]
+    again = api("GET", "/match", {"limit": 7, "cursor": cursor}).body
+    while cursor is not None:
+        res = api("GET", "/match", {"limit": 7, "cursor": cursor})
+        seen += [item["id"] for item in res.body["items"]]
+        cursor = res.body["cursor"]
+    # every item once, and the same page for the same cursor
+    assert sorted(seen) == list(range(1, 26))
+    assert [item["id"] for item in again["items"]] == seen[7:14]
+
+def test_match_bad_cursor(catalog):
+    assert api("GET", "/match", {"cursor": "nonsense"}).status == 400
+    assert api("GET", "/match", {"cursor": "1.-30"}).status == 400
+    assert api("GET", "/match", {"cursor": "-1.0"}).status == 400
+
+def test_match_user_pages(auth_user, database, analytics, catalog):
+    api("POST", "/user", body={"gender": 2, "tags": {}})
+    api("POST", "/interactions", body={
+        "item": {"name": "Test Navy Blue Tshirts 1000; Sample"}, "liked": True})
+    res = api("GET", "/match", {"limit": 4, "cursor": ""})
+    ids = [item["id"] for item in res.body["items"]]
+    while res.body["cursor"] is not None:
+        res = api("GET", "/match", {"limit": 4, "cursor": res.body["cursor"]})
+        ids += [item["id"] for item in res.body["items"]]
+    # the first Tshirts were interacted with
+    assert len(ids) == len(set(ids)) == 9
+    assert 1 not in ids
+
+def test_match_user_seen(auth_user, database, analytics, catalog):
+    def page():
+        res = api("GET", "/match", {"limit": 50, "cursor": ""})
+        return {item["id"] for item in res.body["items"]}
+    def rows():
+        s = analytics()
+        try:
+            return s.query(SeenItems).count()
+        finally:
+            s.close()
+    from Analytics.models import SeenItems
+    api("POST", "/user", body={"gender": 2, "tags": {}})
+    assert len(page()) == 10
+    assert rows() == 0 # paging stores nothing
+    api("POST", "/interactions/batch", body=[
+        {"item": {"name": "Test Navy Blue Tshirts 1000; Sample"}},
+        {"item": {"name": "Test Blue Jeans 1001; Sample"}, "liked": True},
+    ])
+    assert page().isdisjoint({1, 2})
+    assert len(page()) == 8
+    assert api("DELETE", "/interactions", body={"item_id": 1001}).status == 200
+    assert 2 in page()
+
+    assert rows() == 1
+
+    # rebuilt from the interactions for a new catalog
+    s = analytics()
+    s.query(SeenItems).update({"stamp": 0})
+    s.commit()
+    s.close()
+    assert len(page()) == 9
+
+def test_match_seen_stamp(auth_user, database, analytics, catalog, tmp_path, monkeypatch):
+    import os
+    from Analytics.models import SeenItems
+    stamp = catalog.stamp()
+    # init.py rebuilds the catalog, but this process keeps the old one
+    monkeypatch.chdir(tmp_path / "data")
+    os.utime("index", ns=(0, stamp + 1))
+    monkeypatch.chdir(tmp_path)
+    api("POST", "/interactions", body={"item": {"name": "Test Blue Jeans 1001; Sample"}})
+    api("POST", "/interactions", body={"item": {"name": "Test Navy Blue Tshirts 1000; Sample"}})
+    s = analytics()
+    row = s.get(SeenItems, "2")
+    assert row.stamp == stamp
+    assert row.bits[0] == 0b11
+    s.close()
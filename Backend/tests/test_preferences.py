@@ -0,0 +1,84 @@
+import pytest
+
+@pytest.fixture
+def session(analytics):
+    from Analytics.models import User
+    s = analytics()
+    s.add(User(username="gavin", password="", salt="", role=1, fullname="gavin"))
+    s.commit()
+    yield s
+    s.close()
+
+def item(id, category, colour):
+    return {"id": id, "masterCategory": category, "baseColour": colour, "season": "Summer"}
+
+def test_profile_updates(session):
+    from Analytics.crud_interactions import record_interaction, preference_summary
+    record_interaction(session, username="gavin", item_payload=item(1, "Apparel", "Red"), viewed=True, liked=True)
+    record_interaction(session, username="gavin", item_payload=item(2, "Apparel", "Blue"), viewed=True, liked=False)
+    record_interaction(session, username="gavin", item_payload=item(3, "Footwear", "Blue"), viewed=True, liked=False)
+    counts = preference_summary(session, "gavin")["counts"]
+    assert counts["category"] == [("Apparel", 4), ("Footwear", 1)]
+    assert counts["baseColour"] == [("Red", 3), ("Blue", 2)]
+    assert counts["season"] == [("Summer", 5)]
+    assert counts["usage"] == []
+
+def test_profile_backfill(session):
+    from Analytics.crud_interactions import record_interaction, preference_summary
+    from Analytics.models import PreferenceProfile
+    record_interaction(session, username="gavin", item_payload=item(1, "Apparel", "Red"), viewed=True, liked=True)
+    session.query(PreferenceProfile).delete()
+    session.commit()
+    record_interaction(session, username="gavin", item_payload=item(2, "Apparel", "Blue"), viewed=True, liked=False)
+    counts = preference_summary(session, "gavin")["counts"]
+    assert counts["category"] == [("Apparel", 4)]
+    assert counts["baseColour"] == [("Red", 3), ("Blue", 1)]
+
+def test_get_recs(session):
+    from Analytics.crud_interactions import record_interaction, get_recs
+    record_interaction(session, username="gavin", item_payload=item(1, "Apparel", "Red"), viewed=True, liked=True)
+    record_interaction(session, username="gavin", item_payload=item(2, "Footwear", "Blue"), viewed=True, liked=False)
+    assert {rec["id"] for rec in get_recs(session, "gavin")} == {1, 2}
+
+def test_profile_after_endpoints(auth_user, session, catalog):
+    from conftest import api
+    from Analytics.crud_interactions import record_interaction, preference_summary
+    from Analytics.models import User
+    # auth_user is uid 2, whose profile the endpoints then change
+    daniel = session.get(User, 2).username
+    record_interaction(session, username=daniel, item_payload=item(1, "Apparel", "Red"), viewed=True, liked=True)
+    api("POST", "/interactions", body={
+        "item": {"name": "Test Blue Jeans 1001; Sample"}, "liked": True})
+    counts = preference_summary(session, daniel)["counts"]
+    assert counts["baseColour"] == [("Red", 3), ("Blue", 3)]
+
+    assert api("DELETE", "/interactions", body={"item_id": 1001}).status == 200
+    counts = preference_summary(session, daniel)["counts"]
+    assert counts["baseColour"] == [("Red", 3)]
+
+def test_profile_updated_in_place(auth_user, session, catalog):
+    from conftest import api
+    from Analytics.crud_interactions import record_interaction
+    from Analytics.models import User, PreferenceProfile
+    daniel = session.get(User, 2).username
+    record_interaction(session, username=daniel, item_payload=item(1, "Apparel", "Red"), viewed=True, liked=True)
+    # counts that only an update in place keeps; a rebuild would lose them
+    profile = session.get(PreferenceProfile, "2")
+    profile.usage = {"Kept": 1}
+    session.commit()
+    def colours():
+        session.expire_all()
+        return session.get(PreferenceProfile, "2").base_colour
+
+    api("POST", "/interactions/batch", body=[
+        {"item": {"name": "Test Blue Jeans 1001; Sample"}, "liked": True},
+        {"item": {"name": "Test Black Tops 1002; Sample"}},
+    ])
+    assert colours() == {"Red": 3, "Blue": 3, "Black": 1}
+    # replacing an interaction takes back the old one's weight
+    api("POST", "/interactions", body={"item": {"name": "Test Blue Jeans 1001; Sample"}})
+    api("POST", "/interactions/batch", body=[{"item": {"name": "Test Black Tops 1002; Sample"}, "liked": True}])
+    assert colours() == {"Red": 3, "Blue": 1, "Black": 3}
+    assert api("DELETE", "/interactions", body={"item_id": 1002}).status == 200
+    assert colours() == {"Red": 3, "Blue": 1}
+    assert session.get(PreferenceProfile, "2").usage == {"Kept": 1, "Casual": 1}
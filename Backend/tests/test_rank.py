@@ -0,0 +1,62 @@
+import pytest
+from conftest import api
+
+np = pytest.importorskip("numpy")
+
+def test_rank_orders_by_weight(catalog):
+    import rank
+    weights = rank.tag_weights({"Jeans": 5, "Red": 3, "Casual": 1})
+    items = rank.rank(gender=0, weights=weights, limit=8)
+    assert len(items) == 8
+    assert all("Jeans" in item["tags"] for item in items[:5])
+    assert all("Red" in item["tags"] for item in items[5:8])
+
+def test_rank_gender(catalog):
+    import rank
+    items = rank.rank(gender=1, weights=rank.tag_weights({"Tops": 1}), limit=50)
+    assert len(items) == 10
+    assert all(item["gender"] == "Women" for item in items)
+    assert all("Tops" in item["tags"] for item in items[:5])
+
+def test_rank_scores(catalog):
+    import rank
+    scorer = rank.load()
+    scores = scorer.score(gender=2, weights=rank.tag_weights({"Topwear": 2, "Navy Blue": 1}))
+    items = catalog.load()
+    for i in range(len(items)):
+        gender, tags = items.record(i)
+        _, tag_names, _ = catalog.enums()
+        names = [tag_names[tag] for tag in tags]
+        expected = 2 * ("Topwear" in names) + ("Navy Blue" in names) if gender == 2 else -np.inf
+        assert scores[i] == expected
+
+def test_match_ranked(database, catalog):
+    res = api("GET", "/match", {"limit": 7, "ranked": 1})
+    assert res.status == 200
+    assert len(res.body) == 7
+
+def test_match_ranked_user(auth_user, database, catalog):
+    api("POST", "/user", body={"gender": 1, "tags": {"Tops": 1}})
+    res = api("GET", "/match", {"limit": 50, "ranked": 1})
+    assert res.status == 200
+    assert len(res.body) == 10
+    assert all(item["gender"] == "Women" for item in res.body)
+    assert all("Tops" in item["tags"] for item in res.body[:5])
+    assert not any("Tops" in item["tags"] for item in res.body[5:])
+
+def test_match_ranked_history(auth_user, database, analytics, catalog):
+    from Analytics.models import PreferenceProfile
+    api("POST", "/user", body={"gender": 2, "tags": {}})
+    api("POST", "/interactions/batch", body=[
+        {"item": {"name": "Test Blue Jeans 1001; Sample"}, "liked": True},
+    ])
+    s = analytics()
+    s.merge(PreferenceProfile(username="2", category={}, base_colour={"Blue": 3}, season={}, usage={}))
+    s.commit()
+    s.close()
+    res = api("GET", "/match", {"limit": 50, "ranked": 1})
+    assert res.status == 200
+    assert len(res.body) == 9
+    assert 2 not in {item["id"] for item in res.body} # already seen
+    assert all("Jeans" in item["tags"] for item in res.body[:4])
+    assert not any("Jeans" in item["tags"] for item in res.body[4:])
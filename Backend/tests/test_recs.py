@@ -0,0 +1,98 @@
+import pytest
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("datasets")
+pytest.importorskip("PIL")
+
+@pytest.fixture
+def user(monkeypatch):
+    import userSetup
+    df = pd.DataFrame({
+        "id": [100, 101, 102, 103, 104, 105],
+        "gender": ["Men", "Women", "Men", "Unisex", "Men", "Women"],
+        "masterCategory": ["Apparel"] * 6,
+        "baseColour": ["Black", "Black", "Navy Blue", "Black", "Black", "Red"],
+        "season": ["Summer", "Summer", "Summer", "Winter", "Winter", "Summer"],
+        "usage": ["Casual"] * 6,
+        "year": [2012, 2012, 2013, 2012, 2012, 2013],
+        "productDisplayName": [f"Item {i}" for i in range(6)],
+    })
+    monkeypatch.setattr(userSetup.User, "_dataset", None)
+    monkeypatch.setattr(userSetup.User, "_snapshot", None)
+    userSetup.User._load(df)
+    return userSetup.User("test", "test", userSetup.UserRole.USER)
+
+def filtered(user, **prefs):
+    indices, count = user._get_filtered_data(tuple(sorted(prefs.items())))
+    assert count == len(indices)
+    return indices.tolist()
+
+def test_filter(user):
+    assert filtered(user) == [0, 1, 2, 3, 4, 5]
+    assert filtered(user, gender="Male") == [0, 2, 4]
+    assert filtered(user, gender="Male", baseColour="Black") == [0, 4]
+    assert filtered(user, gender="Female", baseColour="Black", season="Summer") == [1]
+    assert filtered(user, baseColour="Navy Blue", year=2013) == [2]
+    assert filtered(user, baseColour="Beige") == []
+    assert filtered(user, baseColour="Black", nonsense="x") == [0, 1, 3, 4]
+
+def test_get_recs(user):
+    import userEnums
+    user.set_init_pref(gender=userEnums.Gender.MALE, baseColour=userEnums.Basecolour.BLACK,
+                       season=userEnums.Season.SUMMER)
+    recs = user.get_recs(10)
+    assert 1 <= len(recs) <= 3
+    assert all(rec["gender"] == "Men" for rec in recs)
+
+def test_get_recs_exclude(user):
+    import userEnums
+    user.set_init_pref(gender=userEnums.Gender.MALE, baseColour=userEnums.Basecolour.BLACK,
+                       season=userEnums.Season.SUMMER)
+    exclude = user.seen_mask([100, 102, 104, 999])
+    assert user.get_recs(10, exclude=exclude) == []
+    exclude = user.seen_mask([100])
+    for _ in range(10):
+        assert all(rec["id"] != 100 for rec in user.get_recs(10, exclude=exclude))
+
+def test_snapshot(tmp_path, monkeypatch):
+    import datasets
+    from PIL import Image
+    import userEnums
+    import userSetup
+    genders = ["Men", "Women", "Men", "Boys"]
+    train = datasets.Dataset.from_dict({
+        "id": [10, 11, 12, 13],
+        "gender": genders,
+        "baseColour": ["Black", "Black", "Red", "Black"],
+        "season": ["Summer"] * 4,
+        "year": [2012.0, 2013.0, None, 2012.0],
+        "productDisplayName": ["Tee", "Top", "Shirt", "Kurta \u00e9"],
+        "image": [Image.new("RGB", (2, 3), (i, 0, 0)) for i in range(4)],
+    }).cast_column("image", datasets.Image())
+    monkeypatch.setattr(userSetup, "load_dataset", lambda *args: {"train": train})
+    monkeypatch.chdir(tmp_path)
+    userSetup.setup_snapshot()
+
+    monkeypatch.setattr(userSetup, "load_dataset", None)
+    monkeypatch.setattr(userSetup.User, "_dataset", None)
+    monkeypatch.setattr(userSetup.User, "_snapshot", None)
+    user = userSetup.User("test", "test", userSetup.UserRole.USER)
+    assert "image" not in user._dataset.columns
+    assert "productDisplayName" not in user._dataset.columns
+
+    user.set_init_pref(gender=userEnums.Gender.MALE, baseColour=userEnums.Basecolour.BLACK,
+                       season=userEnums.Season.SUMMER)
+    recs = user.get_recs(5)
+    assert recs and {rec["id"] for rec in recs} <= {10, 12}
+    assert all(rec["gender"] == "Men" for rec in recs)
+    assert filtered(user, gender="Male", baseColour="Black") == [0]
+
+    record = userSetup.User._record(0)
+    assert record["productDisplayName"] == "Tee"
+    assert record["year"] == 2012.0
+    assert record["image"].size == (2, 3)
+    assert record["image"].getpixel((0, 0)) == (0, 0, 0)
+
+    record = userSetup.User._record(3)
+    assert record["productDisplayName"] == "Kurta \u00e9"
+    assert record["image"].getpixel((0, 0)) == (3, 0, 0)
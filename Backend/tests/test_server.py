@@ -0,0 +1,131 @@
+import asyncio
+import json
+import pytest
+import main
+import server
+
+def request(method, path, query="", body=b""):
+    sent = []
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+    async def send(message):
+        sent.append(message)
+    asyncio.run(server.app({
+        "type": "http",
+        "method": method,
+        "path": path,
+        "query_string": query.encode(),
+        "headers": [],
+    }, receive, send))
+    start, body = sent
+    assert start["type"] == "http.response.start"
+    assert body["type"] == "http.response.body"
+    return start["status"], json.loads(body["body"])
+
+def test_ok():
+    status, body = request("GET", "/api/ok")
+    assert status == 200
+    assert body["message"] == "Welcome to Stylr!"
+
+def test_not_found():
+    status, body = request("GET", "/api/nothing")
+    assert status == 404
+
+def test_login_body(database):
+    status, body = request("POST", "/api/login", body=json.dumps({
+        "username": "yash",
+        "password": "narayan"
+    }).encode())
+    assert status == 200
+    assert "access_token" in body
+
+def test_http():
+    async def run():
+        listener = await asyncio.start_server(server.handle, "127.0.0.1", 0)
+        port = listener.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        for _ in range(2):
+            writer.write(b"GET /api/ok HTTP/1.1\r\nhost: localhost\r\n\r\n")
+            status = await reader.readline()
+            assert status == b"HTTP/1.1 200 OK\r\n"
+            headers = {}
+            while (line := await reader.readline()) != b"\r\n":
+                key, _, value = line.decode().partition(":")
+                headers[key] = value.strip()
+            body = await reader.readexactly(int(headers["content-length"]))
+            assert json.loads(body)["message"] == "Welcome to Stylr!"
+        writer.close()
+        listener.close()
+    asyncio.run(run())
+
+def test_streamed_body(database):
+    body = json.dumps({"username": "yash", "password": "narayan"}).encode()
+    chunks = [body[:5], body[5:20], body[20:]]
+    async def receive():
+        chunk = chunks.pop(0)
+        return {"type": "http.request", "body": chunk, "more_body": bool(chunks)}
+    res = asyncio.run(main.dispatch("POST", "/api/login", "", receive=receive))
+    assert res.status == 200
+    assert "access_token" in res.body
+
+def test_body_too_large(monkeypatch):
+    monkeypatch.setattr(main, "max_body", 16)
+    status, body = request("POST", "/api/login", body=b"{" + b" " * 16 + b"}")
+    assert status == 413
+
+def test_body_not_read():
+    async def receive():
+        raise AssertionError("body should not be read")
+    res = asyncio.run(main.dispatch("GET", "/api/ok", "", receive=receive))
+    assert res.status == 200
+
+def test_offload_concurrently():
+    import time
+    import database
+    async def run():
+        start = time.monotonic()
+        await asyncio.gather(*(database.offload(time.sleep, 0.1) for _ in range(database.pool.size)))
+        return time.monotonic() - start
+    assert asyncio.run(run()) < 0.1 * database.pool.size
+    # without an event loop, it is a plain call
+    with pytest.raises(StopIteration) as stop:
+        database.offload(len, "abc").send(None)
+    assert stop.value.value == 3
+
+def test_http_unread_body_closes():
+    async def run():
+        listener = await asyncio.start_server(server.handle, "127.0.0.1", 0)
+        port = listener.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"GET /api/ok HTTP/1.1\r\ncontent-length: 5\r\n\r\n")
+        assert await reader.readline() == b"HTTP/1.1 200 OK\r\n"
+        await reader.read() # the server hangs up
+        writer.close()
+        listener.close()
+    asyncio.run(run())
+
+def test_ok_not_modified():
+    sent = []
+    async def send(message):
+        sent.append(message)
+    async def run(headers):
+        sent.clear()
+        await server.app({"type": "http", "method": "GET", "path": "/api/ok",
+                          "query_string": b"", "headers": headers}, None, send)
+        return sent[0]["status"], dict(sent[0]["headers"]), sent[1]["body"]
+    status, headers, body = asyncio.run(run([]))
+    assert status == 200 and body == main.ok_payload
+    status, headers, body = asyncio.run(run([(b"if-none-match", headers[b"etag"])]))
+    assert status == 304 and body == b""
+    assert b"content-length" not in headers
+
+def test_compact_json():
+    assert main.encode(main.Response(200, {"a": [1, "é"]})) == '{"a":[1,"é"]}'.encode()
+
+def test_handler_error(monkeypatch):
+    def GET(req):
+        raise RuntimeError("broken")
+    monkeypatch.setitem(main.endpoints, "/fail", {"GET": GET})
+    status, body = request("GET", "/api/fail")
+    assert status == 500
+    assert body["message"] == "Internal Server Error"
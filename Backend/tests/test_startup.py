@@ -0,0 +1,18 @@
+import os
+import sqlite3
+import pytest
+import bench
+from conftest import backend_dir
+
+@pytest.mark.parametrize("method, url, uid, body", bench.endpoints[:3])
+def test_light_endpoints(tmp_path, monkeypatch, method, url, uid, body):
+    conn = sqlite3.connect(tmp_path / "local.db")
+    with open(os.path.join(backend_dir, "init.sql")) as file:
+        conn.executescript(file.read())
+    conn.close()
+    monkeypatch.setenv("STYLR_DATABASE_URL", f"sqlite:{tmp_path / 'local.db'}")
+    monkeypatch.chdir(backend_dir)
+    _, modules = bench.importtime(method, url, uid, body)
+    names = {name for _, name, _ in modules}
+    assert "main" in names
+    assert not names & {"sqlalchemy", "enums", "catalog", "Analytics"}
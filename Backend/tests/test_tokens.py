@@ -0,0 +1,48 @@
+import hmac
+import pytest
+import tokens
+
+def legacy_token(secret, uid, expire):
+    data = f"{uid}.{expire}"
+    return f"{data}.{hmac.new(secret.encode(), data.encode(), 'sha256').hexdigest()}"
+
+def test_legacy_format():
+    keyring = tokens.Keyring({"": "secret"})
+    token = keyring.encode(7, 100, now=1000)
+    assert token == legacy_token("secret", 7, 1100)
+    assert keyring.decode(token, now=1099) == 7
+    assert keyring.decode(token, now=1100) is None
+
+def test_rotation():
+    old = tokens.Keyring({"": "secret"})
+    new = tokens.Keyring({"": "secret", "k2": "other"}, "k2")
+    token = new.encode(7, now=0)
+    assert token.split(".")[2] == "k2"
+    assert new.decode(token, now=1) == 7
+    assert new.decode(old.encode(8, now=0), now=1) == 8
+    assert old.decode(token, now=1) is None
+
+@pytest.mark.parametrize("token", [
+    "", "...", "7", "7.100", "x.100.abc", "7.y.abc", "7.100.nokey.abc",
+    "7.100.é", legacy_token("wrong", 7, 100),
+])
+def test_invalid(token):
+    assert tokens.Keyring({"": "secret"}).decode(token, now=0) is None
+
+def test_decode_many():
+    keyring = tokens.Keyring({"": "secret"})
+    batch = [keyring.encode(uid, now=0) for uid in (1, 2, 1)] + ["bad"]
+    assert keyring.decode_many(batch, now=1) == [1, 2, 1, None]
+
+def test_configured_keys(monkeypatch):
+    import main
+    monkeypatch.setenv("STYLR_TOKEN_KEYS", "a=first; b=second")
+    monkeypatch.setenv("STYLR_TOKEN_KEY_ID", "b")
+    tokens.keyring.cache_clear()
+    try:
+        token = main.swt_encode(5)
+        assert token.split(".")[2] == "b"
+        assert main.swt_decode(token) == 5
+        assert main.swt_decode_many([token, legacy_token(main.secret_key, 6, 2 ** 40)]) == [5, 6]
+    finally:
+        tokens.keyring.cache_clear()
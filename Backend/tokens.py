@@ -0,0 +1,85 @@
+#
+#   Signed access tokens.
+#
+#   A token is "uid.expire.kid.digest", where expire is in seconds since the
+#   epoch and digest is the hex HMAC-SHA256 of "uid.expire.kid" under the
+#   key with id kid. Tokens signed with the key whose id is "" leave the id
+#   out, as "uid.expire.digest", which is also the format tokens had before
+#   there were key ids.
+#
+#   Keys can be rotated by listing them in STYLR_TOKEN_KEYS as
+#   "kid=secret;kid=secret", and naming the one to sign new tokens with in
+#   STYLR_TOKEN_KEY_ID; tokens signed with any listed key stay valid until
+#   they expire. The "" key is main.secret_key unless it is listed.
+#
+
+import hmac
+import os
+import time
+from functools import lru_cache
+
+class Keyring:
+    def __init__(self, keys, current=""):
+        if current not in keys:
+            raise ValueError(f"no token key with id {current!r}")
+        # keyed HMAC states, copied for each token instead of rekeyed
+        self.macs = {}
+        for kid, secret in keys.items():
+            if "." in kid:
+                raise ValueError(f"token key id {kid!r} contains a dot")
+            self.macs[kid] = hmac.new(secret.encode(), digestmod="sha256")
+        self.current = current
+
+    def sign(self, data, kid):
+        mac = self.macs[kid].copy()
+        mac.update(data.encode())
+        return mac.hexdigest()
+
+    def encode(self, uid, expire=86400, now=None):
+        expire += int(time.time() if now is None else now)
+        data = f"{uid}.{expire}.{self.current}" if self.current else f"{uid}.{expire}"
+        return f"{data}.{self.sign(data, self.current)}"
+
+    # returns the uid, or None if the token is malformed, expired, or not
+    # signed with any of the keys
+    def decode(self, token, now=None):
+        data, _, digest = token.rpartition(".")
+        uid, _, rest = data.partition(".")
+        expire, _, kid = rest.partition(".")
+        if kid not in self.macs:
+            return None
+        try:
+            uid = int(uid)
+            expire = int(expire)
+        except ValueError:
+            return None
+        if expire <= (time.time() if now is None else now):
+            return None
+        if not hmac.compare_digest(self.sign(data, kid).encode(), digest.encode()):
+            return None
+        return uid
+
+    # decode() for many tokens at once, checking each distinct token once
+    def decode_many(self, tokens, now=None):
+        now = time.time() if now is None else now
+        seen = {}
+        uids = []
+        for token in tokens:
+            if token not in seen:
+                seen[token] = self.decode(token, now)
+            uids.append(seen[token])
+        return uids
+
+def configured_keys():
+    keys = {}
+    for item in os.getenv("STYLR_TOKEN_KEYS", "").split(";"):
+        kid, sep, secret = item.partition("=")
+        if sep:
+            keys[kid.strip()] = secret
+    return keys, os.getenv("STYLR_TOKEN_KEY_ID", "")
+
+# the keyring for the configured keys, with `secret` as the "" key
+@lru_cache(maxsize=4)
+def keyring(secret):
+    keys, current = configured_keys()
+    return Keyring({"": secret, **keys}, current)
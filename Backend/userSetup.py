@@ -1,6 +1,7 @@
-from datasets import load_dataset
 import pandas as pd
 import numpy as np
+import io
+import json
 import os
 from typing import Any
 from enum import Enum
@@ -9,6 +10,13 @@ from functools import lru_cache
 import userEnums
 from PIL import Image
 
+CATEGORICAL_COLUMNS = ['gender', 'masterCategory', 'subCategory', 'articleType', 'baseColour', 'season', 'usage']
+SNAPSHOT_PATH = "ProdData/catalog"
+
+def load_dataset(*args: Any, **kwargs: Any) -> Any:
+    import datasets # slow to import; only needed when building or without a snapshot
+    return datasets.load_dataset(*args, **kwargs)
+
 def setup_categories()-> None:
     dataset: Any = load_dataset("ashraq/fashion-product-images-small")
     train: pd.DataFrame = pd.DataFrame(dataset["train"])  
@@ -20,6 +28,41 @@ def setup_categories()-> None:
                 for category in train[i].unique():
                     f.write(category + "\n")
 
+def setup_snapshot(path: str = SNAPSHOT_PATH) -> None:
+    # Exports the metadata as one .npy file per column, and the encoded images
+    # back-to-back in images.bin with their offsets in images.npy, so that
+    # User can memory-map what it needs without decoding any images.
+    from datasets import Image as ImageFeature
+    train: Any = load_dataset("ashraq/fashion-product-images-small")["train"]
+    os.makedirs(path, exist_ok=True)
+    df: pd.DataFrame = train.remove_columns("image").to_pandas()
+    columns: dict[str, Any] = {}
+    for col in df.columns:
+        if col in CATEGORICAL_COLUMNS:
+            cat = df[col].astype('category')
+            np.save(f"{path}/{col}.npy", cat.cat.codes.to_numpy())
+            columns[col] = {"categories": [str(value) for value in cat.cat.categories]}
+        elif df[col].dtype == object or pd.api.types.is_string_dtype(df[col]):
+            values = df[col].fillna("").astype(str).str.encode("utf-8")
+            np.save(f"{path}/{col}.npy", np.array(values.tolist(), dtype=bytes))
+            columns[col] = {"encoding": "utf-8"}
+        else:
+            np.save(f"{path}/{col}.npy", df[col].to_numpy())
+            columns[col] = {}
+
+    offsets = np.zeros(len(train) + 1, dtype=np.uint64)
+    images = train.cast_column("image", ImageFeature(decode=False))
+    with open(f"{path}/images.bin", "wb") as f:
+        for i, row in enumerate(images.select_columns(["image"])):
+            data = row["image"]["bytes"] or b""
+            f.write(data)
+            offsets[i + 1] = offsets[i] + len(data)
+    np.save(f"{path}/images.npy", offsets)
+
+    # written last, since its presence marks the snapshot as complete
+    with open(f"{path}/meta.json", "w") as f:
+        json.dump({"rows": len(train), "columns": columns}, f)
+
 class UserRole(Enum):
     ADMIN = "admin"
     USER = "user"
@@ -27,40 +70,95 @@ class UserRole(Enum):
 class User:
     __slots__ = ('username', 'password', 'role', 'pref_counter')
     _dataset = None
+    _masks = None # packed boolean mask per (categorical column, value)
     _sample_pool = None
+    _snapshot = None # memory-mapped columns, when loaded from setup_snapshot()
     
     def __init__(self, username: str, password: str, role: UserRole):
         self.username = username
         self.password = password
         self.role = role
         if User._dataset is None:
-            df = pd.DataFrame(load_dataset("ashraq/fashion-product-images-small")["train"])
-            cat_cols = ['gender', 'masterCategory', 'subCategory', 'articleType', 'baseColour', 'season', 'usage']
-            for col in cat_cols:
-                if col in df.columns:
-                    df[col] = df[col].astype('category')
-            User._dataset = df
-            User._sample_pool = np.arange(len(df))
-    
+            if os.path.exists(f"{SNAPSHOT_PATH}/meta.json"):
+                User._load_snapshot(SNAPSHOT_PATH)
+            else:
+                User._load(pd.DataFrame(load_dataset("ashraq/fashion-product-images-small")["train"]))
+
+    @staticmethod
+    def _load_snapshot(path: str) -> None:
+        with open(f"{path}/meta.json") as f:
+            meta = json.load(f)
+        arrays = {col: np.load(f"{path}/{col}.npy", mmap_mode="r") for col in meta["columns"]}
+        df = pd.DataFrame({
+            col: pd.Categorical.from_codes(arrays[col], info["categories"])
+            for col, info in meta["columns"].items() if "categories" in info
+        })
+        User._snapshot = {
+            "columns": meta["columns"],
+            "arrays": arrays,
+            "images": np.memmap(f"{path}/images.bin", dtype=np.uint8, mode="r")
+                      if os.path.getsize(f"{path}/images.bin") else np.zeros(0, dtype=np.uint8),
+            "offsets": np.load(f"{path}/images.npy", mmap_mode="r"),
+        }
+        User._load(df)
+
+    @staticmethod
+    def _record(i: int) -> dict[str, Any]:
+        snapshot = User._snapshot
+        record: dict[str, Any] = {}
+        for col, info in snapshot["columns"].items():
+            value = snapshot["arrays"][col][i]
+            if "categories" in info: record[col] = info["categories"][value] if value >= 0 else None
+            elif "encoding" in info: record[col] = bytes(value).decode(info["encoding"])
+            else: record[col] = value.item()
+        start, end = snapshot["offsets"][i:i + 2]
+        # Image.open only reads the header; pixels are decoded on first use
+        record["image"] = Image.open(io.BytesIO(snapshot["images"][start:end].tobytes())) if end > start else None
+        return record
+
+    @staticmethod
+    def _load(df: pd.DataFrame) -> None:
+        masks = {}
+        for col in CATEGORICAL_COLUMNS:
+            if col in df.columns:
+                df[col] = df[col].astype('category')
+                codes = df[col].cat.codes.to_numpy()
+                for code, value in enumerate(df[col].cat.categories):
+                    masks[(col, value)] = np.packbits(codes == code)
+        User._dataset = df
+        User._masks = masks
+        User._sample_pool = np.arange(len(df), dtype=np.int32)
+        User._get_filtered_data.cache_clear()
+
+    @staticmethod
+    def _mask(key: str, value: Any) -> np.ndarray:
+        mask = User._masks.get((key, value))
+        if mask is None:
+            df = User._dataset
+            if isinstance(df[key].dtype, pd.CategoricalDtype):
+                mask = np.zeros((len(df) + 7) // 8, dtype=np.uint8) # value never occurs
+            else:
+                mask = np.packbits(df[key].to_numpy() == value)
+        return mask
+
     @staticmethod
     @lru_cache(maxsize=256)
     def _get_filtered_data(prefs_tuple):
         df = User._dataset
-        conditions = []
+        mask = None
         for key, value in prefs_tuple:
             if key == 'gender':
                 gender_map = {'Male': 'Men', 'Female': 'Women'}
-                mapped_gender = gender_map.get(value, value)
-                conditions.append(f"{key} == '{mapped_gender}'")
-            elif key in df.columns:
-                conditions.append(f"{key} == '{value}'")
-        
-        if conditions: 
-            query = ' & '.join(conditions)
-            filtered = df.query(query)
-        else: filtered = df
-        
-        return filtered.index.tolist(), len(filtered)
+                value = gender_map.get(value, value)
+            elif key not in df.columns:
+                continue
+            bits = User._mask(key, value)
+            mask = bits if mask is None else mask & bits
+
+        if mask is None: indices = User._sample_pool
+        else: indices = np.flatnonzero(np.unpackbits(mask, count=len(df))).astype(np.int32)
+
+        return indices, len(indices)
 
     def set_init_pref(self,**kwargs) -> None: # kwargs are of type userEnums
         assert kwargs is not None and len(kwargs) > 2
@@ -71,7 +169,14 @@ class User:
             self.pref_counter = Counter()
         self.pref_counter.update({k: kwargs[k].value for k in kwargs})
 
-    def get_recs(self, num_recs = 5) -> list[Any]:
+    @staticmethod
+    def seen_mask(item_ids: Any) -> np.ndarray:
+        # packed mask of the rows with the given style ids, for get_recs()
+        if User._snapshot is not None: ids = User._snapshot["arrays"]["id"]
+        else: ids = User._dataset["id"].to_numpy()
+        return np.packbits(np.isin(ids, np.fromiter(item_ids, dtype=np.int64)))
+
+    def get_recs(self, num_recs = 5, exclude: np.ndarray | None = None) -> list[Any]:
         from random import sample
         if not hasattr(self, 'pref_counter') or not self.pref_counter: return []
         
@@ -92,8 +197,13 @@ class User:
         
         prefs_tuple = tuple(sorted(selected_prefs.items()))
         indices, count = self._get_filtered_data(prefs_tuple)
+        if exclude is not None:
+            # items the user has seen, as a mask from seen_mask()
+            seen = np.unpackbits(exclude, count=len(User._dataset)).view(bool)
+            indices = indices[~seen[indices]]
+            count = len(indices)
         
-        if not indices: return []
+        if count == 0: return []
         
         n_samples = min(num_recs, count)
         if count <= num_recs:
@@ -101,6 +211,8 @@ class User:
         else:
             sample_indices = np.random.choice(indices, n_samples, replace=False)
         
+        if User._snapshot is not None:
+            return [User._record(int(i)) for i in sample_indices]
         return User._dataset.iloc[sample_indices].to_dict('records')
 
 class budgetMacro:
@@ -124,4 +236,9 @@ def main():
     else:
         print("No recommendations found")
 if __name__ == "__main__":
-    main()
+    import sys
+    # `python userSetup.py snapshot` builds the snapshot in SNAPSHOT_PATH
+    if sys.argv[1:] == ["snapshot"]:
+        setup_snapshot()
+    else:
+        main()
@@ -2,12 +2,17 @@ import { execFile } from "node:child_process";
 import tailwindcss from "@tailwindcss/vite";
 import react from "@vitejs/plugin-react";
 
+// Set to the address of a running `server.py` (e.g. http://localhost:8000)
+// to proxy `/api` to it instead of running `main.py` once per request.
+const backendURL = process.env.STYLR_BACKEND_URL;
+
 /** @type {import("vite").ServerHook} */
 function configureServer(server) {
   execFile("python3", ["init.py"], {
     cwd: "../Backend",
     stdio: "inherit"
   });
+  if (backendURL) return;
   server.middlewares.use("/api", (req, res) => {
     const options = {
       cwd: "../Backend",
@@ -44,6 +49,9 @@ export default {
     }
   },
   clearScreen: false,
+  server: {
+    proxy: backendURL ? { "/api": backendURL } : undefined
+  },
   define: {
     __api: JSON.stringify(process.env.STYLR_API_URL || "/api")
   }